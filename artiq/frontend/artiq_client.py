@@ -23,10 +23,12 @@ def get_argparser():
     parser = argparse.ArgumentParser(description="ARTIQ CLI client")
     parser.add_argument(
         "-s", "--server", default="::1",
-        help="hostname or IP of the master to connect to")
+        help="hostname or IP of the master to connect to, or unix:/path "
+             "of a Unix domain socket the master listens on")
     parser.add_argument(
         "--port", default=None, type=int,
-        help="TCP port to use to connect to the master")
+        help="TCP port to use to connect to the master "
+             "(ignored for Unix domain sockets)")
 
     subparsers = parser.add_subparsers(dest="action")
     subparsers.required = True
@@ -40,6 +42,14 @@ def get_argparser():
     parser_add.add_argument(
         "-t", "--timeout", default=None, type=float,
         help="specify a timeout for the experiment to complete")
+    parser_add.add_argument(
+        "-p", "--priority", default=0, type=int,
+        help="priority (higher value means sooner scheduling, "
+             "default: %(default)s)")
+    parser_add.add_argument(
+        "--pipeline", default=None, type=str,
+        help="pipeline to run the experiment in, one experiment at a time "
+             "(default: none)")
     parser_add.add_argument("-u", "--unit", default=None,
                             help="unit to run")
     parser_add.add_argument("--rtr-group", default=None, type=str,
@@ -109,14 +119,16 @@ def _action_submit(remote, args):
                         else args.file
     }
     if args.timed is None:
-        rid = remote.run_queued(run_params, args.timeout)
+        rid = remote.run_queued(run_params, args.timeout, args.priority,
+                                args.pipeline)
         print("RID: {}".format(rid))
     else:
         if args.timed == "now":
             next_time = None
         else:
             next_time = time.mktime(parse_date(args.timed).timetuple())
-        trid = remote.run_timed(run_params, args.timeout, next_time)
+        trid = remote.run_timed(run_params, args.timeout, next_time,
+                                args.priority, args.pipeline)
         print("TRID: {}".format(trid))
 
 
@@ -146,9 +158,12 @@ def _action_del_parameter(remote, args):
 def _show_queue(queue):
     clear_screen()
     if queue:
-        table = PrettyTable(["RID", "File", "Unit", "Timeout", "Arguments"])
+        table = PrettyTable(["RID", "Pipeline", "Priority", "File", "Unit",
+                             "Timeout", "Arguments"])
         for rid, run_params, timeout in queue:
-            row = [rid, run_params["file"]]
+            pipeline = run_params["pipeline"]
+            row = [rid, "-" if pipeline is None else pipeline,
+                   run_params["priority"], run_params["file"]]
             for x in run_params["unit"], timeout:
                 row.append("-" if x is None else x)
             row.append(format_run_arguments(run_params["arguments"]))
@@ -161,12 +176,14 @@ def _show_queue(queue):
 def _show_timed(timed):
     clear_screen()
     if timed:
-        table = PrettyTable(["Next run", "TRID", "File", "Unit",
-                             "Timeout", "Arguments"])
+        table = PrettyTable(["Next run", "TRID", "Pipeline", "Priority",
+                             "File", "Unit", "Timeout", "Arguments"])
         sp = sorted(timed.items(), key=lambda x: (x[1][0], x[0]))
         for trid, (next_run, run_params, timeout) in sp:
+            pipeline = run_params["pipeline"]
             row = [time.strftime("%m/%d %H:%M:%S", time.localtime(next_run)),
-                   trid, run_params["file"]]
+                   trid, "-" if pipeline is None else pipeline,
+                   run_params["priority"], run_params["file"]]
             for x in run_params["unit"], timeout:
                 row.append("-" if x is None else x)
             row.append(format_run_arguments(run_params["arguments"]))
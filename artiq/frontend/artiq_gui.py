@@ -21,6 +21,14 @@ def get_argparser():
     parser.add_argument(
         "-s", "--server", default="::1",
         help="hostname or IP of the master to connect to")
+    parser.add_argument(
+        "--server-notify", default=None,
+        help="hostname, IP or unix:/path to connect to for notifications "
+             "(default: same as --server)")
+    parser.add_argument(
+        "--server-control", default=None,
+        help="hostname, IP or unix:/path to connect to for control "
+             "(default: same as --server)")
     parser.add_argument(
         "--port-notify", default=3250, type=int,
         help="TCP port to connect to for notifications")
@@ -35,6 +43,10 @@ def get_argparser():
 
 def main():
     args = get_argparser().parse_args()
+    if args.server_notify is None:
+        args.server_notify = args.server
+    if args.server_control is None:
+        args.server_control = args.server
 
     db = FlatFileDB(args.db_file, default_data=dict())
     lmgr = LayoutManager(db)
@@ -46,24 +58,24 @@ def main():
     # share the schedule control and repository connections
     schedule_ctl = AsyncioClient()
     loop.run_until_complete(schedule_ctl.connect_rpc(
-        args.server, args.port_control, "master_schedule"))
+        args.server_control, args.port_control, "master_schedule"))
     atexit.register(lambda: schedule_ctl.close_rpc())
     repository = AsyncioClient()
     loop.run_until_complete(repository.connect_rpc(
-        args.server, args.port_control, "master_repository"))
+        args.server_control, args.port_control, "master_repository"))
     atexit.register(lambda: repository.close_rpc())
 
     scheduler_win = lmgr.create_window(SchedulerWindow,
                                        "scheduler",
                                        schedule_ctl)
     loop.run_until_complete(scheduler_win.sub_connect(
-        args.server, args.port_notify))
+        args.server_notify, args.port_notify))
     atexit.register(
         lambda: loop.run_until_complete(scheduler_win.sub_close()))
 
     parameters_win = lmgr.create_window(ParametersWindow, "parameters")
     loop.run_until_complete(parameters_win.sub_connect(
-        args.server, args.port_notify))
+        args.server_notify, args.port_notify))
     atexit.register(
         lambda: loop.run_until_complete(parameters_win.sub_close()))
 
@@ -76,7 +88,7 @@ def main():
                                       schedule_ctl,
                                       repository)
     loop.run_until_complete(explorer_win.sub_connect(
-        args.server, args.port_notify))
+        args.server_notify, args.port_notify))
     atexit.register(
         lambda: loop.run_until_complete(explorer_win.sub_close()))
     scheduler_win.show_all()
@@ -85,7 +97,7 @@ def main():
 
     rtr = RTResults()
     loop.run_until_complete(rtr.sub_connect(
-        args.server, args.port_notify))
+        args.server_notify, args.port_notify))
     atexit.register(
         lambda: loop.run_until_complete(rtr.sub_close()))
 
@@ -3,11 +3,13 @@
 import asyncio
 import argparse
 import atexit
+from functools import partial
 
 from artiq.protocols.pc_rpc import Server
-from artiq.protocols.sync_struct import Publisher
+from artiq.protocols.sync_struct import Notifier, Publisher
 from artiq.protocols.file_db import FlatFileDB, SimpleHistory
 from artiq.master.scheduler import Scheduler
+from artiq.master.worker import default_preload
 from artiq.master.rt_results import RTResults
 from artiq.master.repository import Repository
 from artiq.tools import verbosity_args, init_logger
@@ -24,6 +26,34 @@ def get_argparser():
     parser.add_argument(
         "--port-control", default=3251, type=int,
         help="TCP port to listen to for control")
+    parser.add_argument(
+        "--unix-notify", default=None, metavar="PATH",
+        help="also listen for notifications on this Unix domain socket")
+    parser.add_argument(
+        "--unix-control", default=None, metavar="PATH",
+        help="also listen for control on this Unix domain socket")
+    parser.add_argument(
+        "--notify-batch-window", default=0, type=float,
+        help="time in seconds during which notifications are collected "
+             "and sent together (default: one event loop iteration)")
+    parser.add_argument(
+        "--concurrent-runs", default=1, type=int,
+        help="maximum number of experiments run at the same time, "
+             "on disjoint sets of devices, not counting those waiting for "
+             "devices (default: %(default)d)")
+    parser.add_argument(
+        "--worker-pool-size", default=1, type=int,
+        help="number of worker processes kept started, at least "
+             "2*concurrent-runs - 1 (default: %(default)d)")
+    parser.add_argument(
+        "--worker-max-runs", default=None, type=int,
+        help="number of runs after which a worker process is replaced "
+             "(default: never)")
+    parser.add_argument(
+        "--worker-preload", default=list(default_preload), nargs="*",
+        metavar="MODULE",
+        help="modules imported by the worker processes before they are "
+             "handed runs (default: %(default)s)")
     verbosity_args(parser)
     return parser
 
@@ -44,26 +74,33 @@ def main():
     atexit.register(lambda: loop.close())
 
     def run_cb(rid, run_params):
-        rtr.current_group = run_params["rtr_group"]
+        group = run_params["rtr_group"]
+        return {
+            "init_rt_results": partial(rtr.init, group),
+            "update_rt_results": partial(rtr.update, group)
+        }
     scheduler = Scheduler({
         "req_device": ddb.request,
         "req_parameter": pdb.request,
-        "set_parameter": pdb.set,
-        "init_rt_results": rtr.init,
-        "update_rt_results": rtr.update
-    }, run_cb)
+        "set_parameter": pdb.set
+    }, run_cb, args.concurrent_runs, args.worker_pool_size,
+        args.worker_max_runs, args.worker_preload)
     loop.run_until_complete(scheduler.start())
     atexit.register(lambda: loop.run_until_complete(scheduler.stop()))
 
+    rpc_stats = Notifier(dict())
     server_control = Server({
         "master_ddb": ddb,
         "master_pdb": pdb,
         "master_schedule": scheduler,
         "master_repository": repository,
         "master_explist": explist
-    })
+    }, stats=rpc_stats)
     loop.run_until_complete(server_control.start(
         args.bind, args.port_control))
+    if args.unix_control is not None:
+        loop.run_until_complete(server_control.start(
+            "unix:" + args.unix_control, None))
     atexit.register(lambda: loop.run_until_complete(server_control.stop()))
 
     server_notify = Publisher({
@@ -73,10 +110,14 @@ def main():
         "parameters": pdb.data,
         "parameters_simplehist": simplephist.history,
         "rt_results": rtr.groups,
-        "explist": explist.data
-    })
+        "explist": explist.data,
+        "rpc_stats": rpc_stats
+    }, args.notify_batch_window)
     loop.run_until_complete(server_notify.start(
         args.bind, args.port_notify))
+    if args.unix_notify is not None:
+        loop.run_until_complete(server_notify.start(
+            "unix:" + args.unix_notify, None))
     atexit.register(lambda: loop.run_until_complete(server_notify.stop()))
 
     loop.run_forever()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 from artiq.devices.lda.driver import Lda, Ldasim
 from artiq.protocols.pc_rpc import simple_server_loop
@@ -28,8 +29,10 @@ def main():
         lda = Ldasim()
     else:
         lda = Lda(args.serial, args.device)
-    simple_server_loop({"lda": lda},
-                       args.bind, args.port)
+    # a single thread keeps the device calls serialized
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        simple_server_loop({"lda": lda},
+                           args.bind, args.port, executor=executor)
 
 if __name__ == "__main__":
     main()
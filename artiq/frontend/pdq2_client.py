@@ -70,10 +70,11 @@ def main():
     elif args.dcm == 0:
         dev.write_cmd("DCM_DIS")
         dev.set_freq(50e6)
-    dev.write_cmd("START_DIS")
-
-    num_channels = dev.get_num_channels()
-    num_frames = dev.get_num_frames()
+    _, num_channels, num_frames = dev.call_rpc_batch([
+        ("write_cmd", ("START_DIS", )),
+        ("get_num_channels", ),
+        ("get_num_frames", )
+    ])
     times = eval(args.times, globals(), {})
     voltages = eval(args.voltages, globals(), dict(t=times))
 
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 from artiq.devices.pdq2.driver import Pdq2
 from artiq.protocols.pc_rpc import simple_server_loop
@@ -30,8 +31,11 @@ def main():
 
     dev = Pdq2(serial=args.serial)
     try:
-        simple_server_loop({"pdq2": dev}, args.bind, args.port,
-                           id_parameters="serial=" + str(args.serial))
+        # a single thread keeps the device calls serialized
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            simple_server_loop({"pdq2": dev}, args.bind, args.port,
+                               id_parameters="serial=" + str(args.serial),
+                               executor=executor)
     finally:
         dev.close()
 
@@ -110,11 +110,24 @@ class RTResults:
         return self.current_groups
 
     def on_mod(self, mod):
-        if mod["action"] != "init" and len(mod["path"]) >= 2:
-            path = mod["path"]
-            group = self.current_groups[path[0]]
-            if path[1] == "data":
-                if len(mod["path"]) >= 3:
-                    group.on_data_modified(path[2])
-                else:
-                    group.on_data_modified(mod["key"])
+        if mod["action"] == "batch":
+            mods = mod["mods"]
+        else:
+            mods = [mod]
+        # refresh each view once per batch
+        modified = set()
+        for mod in mods:
+            if mod["action"] != "init" and len(mod["path"]) >= 2:
+                path = mod["path"]
+                if path[1] == "data":
+                    if len(path) >= 3:
+                        modified.add((path[0], path[2]))
+                    else:
+                        modified.add((path[0], mod["key"]))
+        for group_name, key in modified:
+            try:
+                group = self.current_groups[group_name]
+            except KeyError:
+                # group deleted later in the batch
+                continue
+            group.on_data_modified(key)
@@ -11,7 +11,9 @@ from artiq.tools import format_run_arguments
 class _QueueStoreSyncer(ListSyncer):
     def convert(self, x):
         rid, run_params, timeout = x
-        row = [rid, run_params["file"]]
+        pipeline = run_params["pipeline"]
+        row = [rid, "-" if pipeline is None else pipeline,
+               run_params["priority"], run_params["file"]]
         for e in run_params["unit"], timeout:
             row.append("-" if e is None else str(e))
         row.append(format_run_arguments(run_params["arguments"]))
@@ -25,8 +27,10 @@ class _TimedStoreSyncer(DictSyncer):
 
     def convert(self, trid, x):
         next_run, run_params, timeout = x
+        pipeline = run_params["pipeline"]
         row = [time.strftime("%m/%d %H:%M:%S", time.localtime(next_run)),
-               trid, run_params["file"]]
+               trid, "-" if pipeline is None else pipeline,
+               run_params["priority"], run_params["file"]]
         for e in run_params["unit"], timeout:
             row.append("-" if e is None else str(e))
         row.append(format_run_arguments(run_params["arguments"]))
@@ -55,9 +59,10 @@ class SchedulerWindow(Window):
         notebook = Gtk.Notebook()
         topvbox.pack_start(notebook, True, True, 0)
 
-        self.queue_store = Gtk.ListStore(int, str, str, str, str)
+        self.queue_store = Gtk.ListStore(int, str, int, str, str, str, str)
         self.queue_tree = Gtk.TreeView(self.queue_store)
-        for i, title in enumerate(["RID", "File", "Unit", "Timeout", "Arguments"]):
+        for i, title in enumerate(["RID", "Pipeline", "Priority", "File",
+                                   "Unit", "Timeout", "Arguments"]):
             renderer = Gtk.CellRendererText()
             column = Gtk.TreeViewColumn(title, renderer, text=i)
             self.queue_tree.append_column(column)
@@ -68,9 +73,11 @@ class SchedulerWindow(Window):
         hbox = Gtk.HBox(spacing=6)
         button = Gtk.Button("Find")
         hbox.pack_start(button, True, True, 0)
-        button = Gtk.Button("Move up")
+        button = Gtk.Button("Raise priority")
+        button.connect("clicked", self.change_priority, 1)
         hbox.pack_start(button, True, True, 0)
-        button = Gtk.Button("Move down")
+        button = Gtk.Button("Lower priority")
+        button.connect("clicked", self.change_priority, -1)
         hbox.pack_start(button, True, True, 0)
         button = Gtk.Button("Remove")
         button.connect("clicked", self.remove_queued)
@@ -79,10 +86,11 @@ class SchedulerWindow(Window):
         vbox.set_border_width(6)
         notebook.insert_page(vbox, Gtk.Label("Queue"), -1)
 
-        self.timed_store = Gtk.ListStore(str, int, str, str, str, str)
+        self.timed_store = Gtk.ListStore(str, int, str, int,
+                                         str, str, str, str)
         self.timed_tree = Gtk.TreeView(self.timed_store)
-        for i, title in enumerate(["Next run", "TRID", "File", "Unit",
-                                   "Timeout", "Arguments"]):
+        for i, title in enumerate(["Next run", "TRID", "Pipeline", "Priority",
+                                   "File", "Unit", "Timeout", "Arguments"]):
             renderer = Gtk.CellRendererText()
             column = Gtk.TreeViewColumn(title, renderer, text=i)
             self.timed_tree.append_column(column)
@@ -102,6 +110,13 @@ class SchedulerWindow(Window):
             rid = store[selected][0]
             asyncio.Task(self.schedule_ctl.cancel_queued(rid))
 
+    def change_priority(self, widget, increment):
+        store, selected = self.queue_tree.get_selection().get_selected()
+        if selected is not None:
+            rid, priority = store[selected][0], store[selected][2]
+            asyncio.Task(self.schedule_ctl.set_priority(rid,
+                                                        priority + increment))
+
     def remove_timed(self, widget):
         store, selected = self.timed_tree.get_selection().get_selected()
         if selected is not None:
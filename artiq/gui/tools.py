@@ -68,9 +68,24 @@ class ListSyncer:
     def append(self, x):
         self.store.append(self.convert(x))
 
+    def extend(self, x):
+        for e in x:
+            self.append(e)
+
     def insert(self, i, x):
         self.store.insert(i, self.convert(x))
 
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self.store))
+            for i in reversed(range(start, max(start, stop))):
+                del self.store[i]
+            for i, x in enumerate(value):
+                self.insert(start + i, x)
+        else:
+            del self.store[key]
+            self.insert(key, value)
+
     def __delitem__(self, key):
         del self.store[key]
 
@@ -4,12 +4,18 @@ import importlib
 from artiq.protocols.sync_struct import Notifier
 
 
+class _ResultNotifier(Notifier):
+    # Results are not initialized as kernel attributes. Nested notifiers
+    # have the class of their parent.
+    kernel_attr_init = False
+
+
 class ResultDB:
     def __init__(self, realtime_results):
-        self.realtime_data = Notifier({x: [] for x in realtime_results})
-        self.data = Notifier(dict())
+        self.realtime_data = _ResultNotifier({x: [] for x in realtime_results})
+        self.data = _ResultNotifier(dict())
 
-    def _request(self, name):
+    def request(self, name):
         try:
             return self.realtime_data[name]
         except KeyError:
@@ -19,11 +25,6 @@ class ResultDB:
                 self.data[name] = []
                 return self.data[name]
 
-    def request(self, name):
-        r = self._request(name)
-        r.kernel_attr_init = False
-        return r
-
     def set(self, name, value):
         if name in self.realtime_data.read:
             self.realtime_data[name] = value
@@ -4,9 +4,8 @@ from artiq.protocols.sync_struct import Notifier, process_mod
 class RTResults:
     def __init__(self):
         self.groups = Notifier(dict())
-        self.current_group = "default"
 
-    def init(self, description):
+    def init(self, group, description):
         data = dict()
         for rtr in description.keys():
             if isinstance(rtr, tuple):
@@ -14,11 +13,12 @@ class RTResults:
                     data[e] = []
             else:
                 data[rtr] = []
-        self.groups[self.current_group] = {
+        self.groups[group] = {
             "description": description,
             "data": data
         }
 
-    def update(self, mod):
-        target = self.groups[self.current_group]["data"]
-        process_mod(target, mod)
+    def update(self, group, mods):
+        target = self.groups[group]["data"]
+        for mod in mods:
+            process_mod(target, mod)
@@ -1,19 +1,175 @@
 import asyncio
+import heapq
+from bisect import bisect_left
 from time import time
 
 from artiq.protocols.sync_struct import Notifier
-from artiq.master.worker import Worker
+from artiq.master.worker import WorkerPool, RunFailed, default_preload
+
+
+class _DeviceLocks:
+    # Grants sets of devices to runs, and limits the number of active runs:
+    # those that hold their devices, or have not told yet which they need.
+    # Runs are registered in queue order, before their worker tells which
+    # devices they need. A request is granted once none of its devices is
+    # held, or requested by a run registered earlier that is still waiting,
+    # so that runs sharing devices get them in queue order.
+    def __init__(self, max_active):
+        self.max_active = max_active
+        self._held = dict()  # device name -> RID
+        self._granted = set()  # RIDs
+        self._pending = []  # [RID, devices or None if unknown, future]
+
+    def active(self):
+        return len(self._granted) + sum(1 for p in self._pending
+                                        if p[1] is None)
+
+    def waiting(self):
+        return sum(1 for p in self._pending if p[1] is not None)
+
+    def can_start(self):
+        # Runs waiting for devices do not count as active, but are bounded
+        # as well, as each of them occupies a worker.
+        return (self.active() < self.max_active
+                and self.waiting() < self.max_active)
+
+    def _grant_pending(self):
+        active = self.active()
+        requested = set()
+        pending = []
+        for entry in self._pending:
+            rid, devices, future = entry
+            if future.cancelled():
+                # the run is being stopped
+                continue
+            if devices is None:
+                pending.append(entry)
+            elif (active < self.max_active
+                    and devices.isdisjoint(self._held)
+                    and devices.isdisjoint(requested)):
+                for device in devices:
+                    self._held[device] = rid
+                self._granted.add(rid)
+                active += 1
+                future.set_result(None)
+            else:
+                requested |= devices
+                pending.append(entry)
+        self._pending = pending
+
+    def register(self, rid):
+        self._pending.append([rid, None, asyncio.Future()])
+
+    def acquire(self, rid, devices):
+        # Returns a future that completes when the devices are granted.
+        request = next((p for p in self._pending
+                        if p[0] == rid and p[1] is None), None)
+        if request is None:
+            raise RuntimeError("Devices already acquired by RID {}"
+                               .format(rid))
+        request[1] = set(devices)
+        self._grant_pending()
+        return request[2]
+
+    def try_acquire(self, rid, device):
+        # Devices that were not declared, e.g. those used by the drivers of
+        # the declared devices, are only given to a run that holds its
+        # declared devices, if no other run holds them or waits for them.
+        if rid not in self._granted:
+            return False
+        holder = self._held.get(device)
+        if holder is None:
+            if any(p[1] is not None and device in p[1]
+                   for p in self._pending):
+                return False
+            self._held[device] = rid
+            return True
+        return holder == rid
+
+    def release(self, rid):
+        self._held = {device: holder for device, holder in self._held.items()
+                      if holder != rid}
+        self._granted.discard(rid)
+        self._pending = [p for p in self._pending if p[0] != rid]
+        self._grant_pending()
 
 
 class Scheduler:
-    def __init__(self, worker_handlers, run_cb):
+    """Runs the experiments of the queue and the timed experiments.
+
+    Experiments are submitted with a priority, and optionally to a named
+    pipeline, which runs one experiment at a time. Experiments are started
+    by decreasing priority, and then in the order they are due: queued
+    experiments are due when submitted, and timed experiments at their next
+    run time. Each one runs in its own worker process.
+
+    Before running, an experiment acquires the devices declared in its
+    ``DBKeys`` (including the implicit core device), or those given in the
+    ``devices`` entry of its run parameters, and waits until no other run
+    holds any of them. Experiments that share devices are therefore
+    serialized in the order they were started, while for example host-only
+    analyses run alongside kernel experiments. A device that was not
+    declared, for example one used by the driver of a declared device, is
+    held by the run that requests it until it ends. Requesting it fails if
+    another run holds it or waits for it.
+
+    At most ``concurrent_runs`` experiments are active, i.e. hold their
+    devices or are starting. Experiments waiting for devices are not
+    counted, so that the next experiments in the queue can start meanwhile
+    if they do not need the same devices, but at most ``concurrent_runs``
+    experiments wait at the same time.
+
+    The priority and the pipeline are added to the run parameters of the
+    experiments in the ``queue`` and ``timed`` notifiers. The running
+    experiments are the first entries of the ``queue`` notifier, followed by
+    the others by decreasing priority and in the order they are due.
+
+    :param worker_handlers: Handlers of the requests of the workers (see
+        ``Worker``).
+    :param run_cb: Function called with the RID and the run parameters
+        before each run. It may return a dictionary of handlers that
+        override ``worker_handlers`` for this run.
+    :param concurrent_runs: Maximum number of active experiments.
+    :param worker_pool_size: Number of worker processes to keep (see
+        ``WorkerPool``). At least ``2*concurrent_runs - 1`` are kept, the
+        maximum number of active and waiting experiments.
+
+    """
+    def __init__(self, worker_handlers, run_cb, concurrent_runs=1,
+                 worker_pool_size=1, worker_max_runs=None,
+                 worker_preload=default_preload):
+        self.worker_handlers = worker_handlers
         self.run_cb = run_cb
-        self.worker = Worker(worker_handlers)
+        self.concurrent_runs = concurrent_runs
+        self.worker_pool = WorkerPool(
+            worker_handlers, max(worker_pool_size, 2*concurrent_runs - 1),
+            worker_max_runs, preload=worker_preload)
         self.next_rid = 0
         self.queue = Notifier([])
         self.queue_modified = asyncio.Event()
         self.timed = Notifier(dict())
         self.timed_modified = asyncio.Event()
+        # The queue notifier is kept sorted by the keys of its entries:
+        # (0, sequence number) for running experiments, and
+        # (1, -priority, due time, sequence number) for the others.
+        self._queue_keys = dict()  # RID -> key
+        self._queue_order = []  # sorted keys of the queue entries
+        self._next_seq = 0
+        # pipeline name -> heap of (key, RID) of the experiments waiting in
+        # the pipeline, with the name None for those submitted without a
+        # pipeline. Cancelled experiments and experiments whose key changed
+        # are left in the heap and skipped when they reach the top.
+        self._pipelines = dict()
+        self._running = dict()  # RID -> task
+        self._busy_pipelines = set()
+        # (next_run, sequence number, TRID) of the timed runs. Cancelled
+        # runs are left in the heap and skipped when they reach the top.
+        self._timed_heap = []
+        self._timed_seqs = dict()  # TRID -> sequence number in the heap
+        self._next_timed_seq = 0
+        self._free_trids = []  # heap
+        self._next_trid = 0
+        self._device_locks = _DeviceLocks(concurrent_runs)
 
     def new_rid(self):
         r = self.next_rid
@@ -21,106 +177,245 @@ class Scheduler:
         return r
 
     def new_trid(self):
-        trids = set(range(len(self.timed.read) + 1))
-        trids -= set(self.timed.read.keys())
-        return next(iter(trids))
+        if self._free_trids:
+            return heapq.heappop(self._free_trids)
+        r = self._next_trid
+        self._next_trid += 1
+        return r
 
     @asyncio.coroutine
     def start(self):
+        yield from self.worker_pool.start()
         self.task = asyncio.Task(self._schedule())
-        yield from self.worker.create_process()
 
     @asyncio.coroutine
     def stop(self):
         self.task.cancel()
         yield from asyncio.wait([self.task])
         del self.task
-        yield from self.worker.end_process()
+        running = list(self._running.values())
+        for task in running:
+            task.cancel()
+        if running:
+            yield from asyncio.wait(running)
+        yield from self.worker_pool.stop()
 
-    def run_queued(self, run_params, timeout):
-        rid = self.new_rid()
-        self.queue.append((rid, run_params, timeout))
+    def _new_seq(self):
+        r = self._next_seq
+        self._next_seq += 1
+        return r
+
+    def _insert_queued(self, key, entry):
+        idx = bisect_left(self._queue_order, key)
+        self._queue_order.insert(idx, key)
+        self._queue_keys[entry[0]] = key
+        self.queue.insert(idx, entry)
+
+    def _remove_queued(self, rid):
+        key = self._queue_keys.pop(rid)
+        idx = bisect_left(self._queue_order, key)
+        del self._queue_order[idx]
+        entry = self.queue.read[idx]
+        del self.queue[idx]
+        return entry
+
+    def _enqueue(self, rid, run_params, timeout, due_time, seq=None):
+        if seq is None:
+            seq = self._new_seq()
+        key = (1, -run_params["priority"], due_time, seq)
+        self._insert_queued(key, (rid, run_params, timeout))
+        heapq.heappush(self._pipelines.setdefault(run_params["pipeline"], []),
+                       (key, rid))
         self.queue_modified.set()
+
+    def run_queued(self, run_params, timeout, priority=0, pipeline=None):
+        run_params = dict(run_params, priority=priority, pipeline=pipeline)
+        rid = self.new_rid()
+        self._enqueue(rid, run_params, timeout, time())
         return rid
 
     def cancel_queued(self, rid):
-        idx = next(idx for idx, (qrid, _, _)
-                   in enumerate(self.queue.read)
-                   if qrid == rid)
-        if idx == 0:
+        if rid in self._running:
             # Cannot cancel when already running
             raise NotImplementedError
-        del self.queue[idx]
+        self._remove_queued(rid)
+
+    def set_priority(self, rid, priority):
+        """Changes the priority of a queued experiment that is not running
+        yet.
+
+        """
+        if rid in self._running:
+            raise NotImplementedError
+        _, _, due_time, seq = self._queue_keys[rid]
+        _, run_params, timeout = self._remove_queued(rid)
+        run_params = dict(run_params, priority=priority)
+        self._enqueue(rid, run_params, timeout, due_time, seq)
 
-    def run_timed(self, run_params, timeout, next_run):
+    def run_timed(self, run_params, timeout, next_run, priority=0,
+                  pipeline=None):
+        run_params = dict(run_params, priority=priority, pipeline=pipeline)
         if next_run is None:
             next_run = time()
         trid = self.new_trid()
         self.timed[trid] = next_run, run_params, timeout
+        seq = self._next_timed_seq
+        self._next_timed_seq += 1
+        self._timed_seqs[trid] = seq
+        heapq.heappush(self._timed_heap, (next_run, seq, trid))
         self.timed_modified.set()
         return trid
 
-    def cancel_timed(self, trid):
+    def _remove_timed(self, trid):
         del self.timed[trid]
+        del self._timed_seqs[trid]
+        heapq.heappush(self._free_trids, trid)
+        if len(self._timed_heap) > 2*len(self._timed_seqs) + 16:
+            self._timed_heap = [e for e in self._timed_heap
+                                if self._timed_seqs.get(e[2]) == e[1]]
+            heapq.heapify(self._timed_heap)
+
+    def cancel_timed(self, trid):
+        self._remove_timed(trid)
+
+    def _device_set(self, names):
+        # Follows the aliases of the device database, so that runs using
+        # the same device under different names conflict.
+        req_device = self.worker_handlers["req_device"]
+        devices = set()
+        for name in names:
+            while name not in devices:
+                devices.add(name)
+                try:
+                    desc = req_device(name)
+                except KeyError:
+                    break
+                if not isinstance(desc, str):
+                    break
+                name = desc
+        return devices
+
+    def _run_handlers(self, rid, run_params):
+        handlers = dict(self.worker_handlers)
+        run_handlers = self.run_cb(rid, run_params)
+        if run_handlers is not None:
+            handlers.update(run_handlers)
+
+        @asyncio.coroutine
+        def acquire_devices(names):
+            granted = self._device_locks.acquire(rid, self._device_set(names))
+            # other runs may start while this one waits
+            self.queue_modified.set()
+            yield from granted
+
+        req_device = handlers["req_device"]
+
+        def checked_req_device(name):
+            if not self._device_locks.try_acquire(rid, name):
+                raise KeyError("Device '{}' was not declared by RID {} "
+                               "and is used by another run".format(name, rid))
+            return req_device(name)
+
+        handlers["acquire_devices"] = acquire_devices
+        handlers["req_device"] = checked_req_device
+        return handlers
 
     @asyncio.coroutine
     def _run(self, rid, run_params, timeout):
-        self.run_cb(rid, run_params)
         try:
-            yield from self.worker.run(run_params, timeout)
-        except Exception as e:
-            print("RID {} failed:".format(rid))
-            print(e)
-        else:
-            print("RID {} completed successfully".format(rid))
+            handlers = self._run_handlers(rid, run_params)
+            worker = yield from self.worker_pool.get()
+            # replace the worker unless the run ended normally
+            worker_failed = True
+            try:
+                yield from worker.run(run_params, timeout, handlers)
+            except RunFailed as e:
+                worker_failed = False
+                print("RID {} failed:".format(rid))
+                print(e)
+            except Exception as e:
+                print("RID {} failed:".format(rid))
+                print(e)
+            else:
+                worker_failed = False
+                print("RID {} completed successfully".format(rid))
+            finally:
+                self.worker_pool.put(worker, worker_failed)
+        finally:
+            self._device_locks.release(rid)
+            del self._running[rid]
+            self._busy_pipelines.discard(run_params["pipeline"])
+            self._remove_queued(rid)
+            self.queue_modified.set()
 
-    @asyncio.coroutine
-    def _run_timed(self):
-        while True:
-            min_next_run = None
-            min_trid = None
-            for trid, params in self.timed.read.items():
-                if min_next_run is None or params[0] < min_next_run:
-                    min_next_run = params[0]
-                    min_trid = trid
+    def _queue_timed(self):
+        # Moves the due timed runs to the queue, and returns the time until
+        # the next one is due, or None if there are none.
+        while self._timed_heap:
+            next_run, seq, trid = self._timed_heap[0]
+            if self._timed_seqs.get(trid) != seq:
+                # cancelled
+                heapq.heappop(self._timed_heap)
+                continue
+
+            delay = next_run - time()
+            if delay > 0:
+                return delay
 
-            now = time()
+            heapq.heappop(self._timed_heap)
+            next_run, run_params, timeout = self.timed.read[trid]
+            self._remove_timed(trid)
 
-            if min_next_run is None:
-                return None
-            min_next_run -= now
-            if min_next_run > 0:
-                return min_next_run
+            self._enqueue(self.new_rid(), run_params, timeout, next_run)
+        return None
 
-            next_run, run_params, timeout = self.timed.read[min_trid]
-            del self.timed[min_trid]
+    def _next_run(self):
+        # Returns the pipeline and the (key, RID) of the highest-priority
+        # experiment that can be started, or None.
+        best = None
+        for pipeline, heap in list(self._pipelines.items()):
+            while heap and self._queue_keys.get(heap[0][1]) != heap[0][0]:
+                heapq.heappop(heap)
+            if not heap:
+                del self._pipelines[pipeline]
+            elif (pipeline not in self._busy_pipelines
+                    and (best is None or heap[0] < best[1])):
+                best = pipeline, heap[0]
+        return best
 
-            rid = self.new_rid()
-            self.queue.insert(0, (rid, run_params, timeout))
-            yield from self._run(rid, run_params, timeout)
-            del self.queue[0]
+    def _start_runs(self):
+        while self._device_locks.can_start():
+            next_run = self._next_run()
+            if next_run is None:
+                break
+            pipeline, (key, rid) = next_run
+            heapq.heappop(self._pipelines[pipeline])
+            entry = self._remove_queued(rid)
+            self._insert_queued((0, self._new_seq()), entry)
+            if pipeline is not None:
+                self._busy_pipelines.add(pipeline)
+            self._device_locks.register(rid)
+            _, run_params, timeout = entry
+            self._running[rid] = asyncio.Task(
+                self._run(rid, run_params, timeout))
 
     @asyncio.coroutine
     def _schedule(self):
         while True:
-            next_timed = yield from self._run_timed()
-            if self.queue.read:
-                rid, run_params, timeout = self.queue.read[0]
-                yield from self._run(rid, run_params, timeout)
-                del self.queue[0]
-            else:
-                self.queue_modified.clear()
-                self.timed_modified.clear()
-                t1 = asyncio.Task(self.queue_modified.wait())
-                t2 = asyncio.Task(self.timed_modified.wait())
-                try:
-                    done, pend = yield from asyncio.wait(
-                        [t1, t2],
-                        timeout=next_timed,
-                        return_when=asyncio.FIRST_COMPLETED)
-                except:
-                    t1.cancel()
-                    t2.cancel()
-                    raise
-                for t in pend:
-                    t.cancel()
+            next_timed = self._queue_timed()
+            self._start_runs()
+            self.queue_modified.clear()
+            self.timed_modified.clear()
+            t1 = asyncio.Task(self.queue_modified.wait())
+            t2 = asyncio.Task(self.timed_modified.wait())
+            try:
+                done, pend = yield from asyncio.wait(
+                    [t1, t2],
+                    timeout=next_timed,
+                    return_when=asyncio.FIRST_COMPLETED)
+            except:
+                t1.cancel()
+                t2.cancel()
+                raise
+            for t in pend:
+                t.cancel()
@@ -3,10 +3,17 @@ import asyncio
 import subprocess
 import signal
 import traceback
+from collections import deque
 
 from artiq.protocols import pyon
 
 
+#: Modules imported by default by the worker processes before they are
+#: handed runs: the kernel compiler and the core device drivers, whose
+#: import also initializes LLVM.
+default_preload = ("artiq.coredevice.core", "artiq.coredevice.comm_serial")
+
+
 class WorkerFailed(Exception):
     pass
 
@@ -16,18 +23,34 @@ class RunFailed(Exception):
 
 
 class Worker:
-    def __init__(self, handlers,
-                 send_timeout=0.5, start_reply_timeout=1.0, term_timeout=1.0):
+    def __init__(self, handlers, preload=(),
+                 send_timeout=0.5, start_reply_timeout=1.0, term_timeout=1.0,
+                 ready_timeout=30.0):
         self.handlers = handlers
+        self.preload = preload
         self.send_timeout = send_timeout
         self.start_reply_timeout = start_reply_timeout
         self.term_timeout = term_timeout
+        self.ready_timeout = ready_timeout
+        self.runs = 0
 
     @asyncio.coroutine
     def create_process(self):
+        """Starts the worker process and waits until it has imported the
+        modules to preload.
+
+        """
         self.process = yield from asyncio.create_subprocess_exec(
             sys.executable, "-m", "artiq.master.worker_impl",
+            *self.preload,
             stdout=subprocess.PIPE, stdin=subprocess.PIPE)
+        try:
+            obj = yield from self._recv(self.ready_timeout)
+            if obj != "ready":
+                raise WorkerFailed("Incorrect ready message")
+        except:
+            yield from self.end_process()
+            raise
 
     @asyncio.coroutine
     def _send(self, obj, timeout):
@@ -60,7 +83,17 @@ class Worker:
         return obj
 
     @asyncio.coroutine
-    def run(self, run_params, result_timeout):
+    def run(self, run_params, result_timeout, handlers=None):
+        """Runs an experiment and serves the requests of the worker until
+        it completes.
+
+        :param handlers: Handlers to use for this run instead of those given
+            at construction. Handlers may be coroutines.
+
+        """
+        if handlers is None:
+            handlers = self.handlers
+        self.runs += 1
         yield from self._send(run_params, self.send_timeout)
         obj = yield from self._recv(self.start_reply_timeout)
         if obj != "ack":
@@ -75,13 +108,21 @@ class Worker:
                     return
             else:
                 del obj["action"]
+                # requests with "reply" set to False are notifications
+                send_reply = obj.pop("reply", True)
                 try:
-                    data = self.handlers[action](**obj)
+                    data = handlers[action](**obj)
+                    if asyncio.iscoroutine(data):
+                        data = yield from data
                     reply = {"status": "ok", "data": data}
                 except:
                     reply = {"status": "failed",
                              "message": traceback.format_exc()}
-                yield from self._send(reply, self.send_timeout)
+                if send_reply:
+                    yield from self._send(reply, self.send_timeout)
+                elif reply["status"] != "ok":
+                    print("Failed to process {} from worker:".format(action))
+                    print(reply["message"])
 
     @asyncio.coroutine
     def end_process(self):
@@ -93,3 +134,118 @@ class Worker:
                 self.process.wait(), timeout=self.term_timeout)
         except asyncio.TimeoutError:
             self.process.send_signal(signal.SIGKILL)
+
+
+class WorkerPool:
+    """Keeps worker processes started in advance, so that runs do not wait
+    for the Python interpreter to start and import the heavy modules.
+
+    Workers are taken from the pool with ``get`` and must be given back with
+    ``put``. Workers that failed or that have done ``max_runs`` runs are
+    terminated and replaced in the background.
+
+    :param handlers: Handlers of the requests of the workers (see
+        ``Worker``).
+    :param size: Number of worker processes to keep. With more than one,
+        a worker that needs replacing is replaced by one that is already
+        running.
+    :param max_runs: Number of runs after which a worker is replaced, e.g.
+        1 to start each run in a fresh interpreter. ``None`` to reuse
+        workers indefinitely.
+    :param worker_options: Keyword arguments passed to ``Worker``.
+
+    """
+    def __init__(self, handlers, size=1, max_runs=None, **worker_options):
+        if size < 1:
+            raise ValueError("Worker pool size must be at least 1")
+        self.handlers = handlers
+        self.size = size
+        self.max_runs = max_runs
+        self.worker_options = worker_options
+        self._workers = set()
+        self._idle = deque()
+        self._idle_available = asyncio.Event()
+        self._tasks = set()
+
+    @asyncio.coroutine
+    def _spawn(self):
+        worker = Worker(self.handlers, **self.worker_options)
+        yield from worker.create_process()
+        self._workers.add(worker)
+        self._idle.append(worker)
+        self._idle_available.set()
+
+    @asyncio.coroutine
+    def _replace(self, worker):
+        self._workers.discard(worker)
+        yield from worker.end_process()
+        delay = 1.0
+        while True:
+            try:
+                yield from self._spawn()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Failed to start worker, retrying in {}s:"
+                      .format(delay))
+                print(e)
+                yield from asyncio.sleep(delay)
+                delay = min(2*delay, 60.0)
+            else:
+                return
+
+    def _start_task(self, coro):
+        task = asyncio.Task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @asyncio.coroutine
+    def start(self):
+        """Starts the worker processes and waits until they are ready."""
+        yield from asyncio.gather(*[self._spawn() for i in range(self.size)])
+
+    @asyncio.coroutine
+    def get(self):
+        """Returns a worker ready to run, waiting for one if necessary."""
+        while True:
+            while not self._idle:
+                self._idle_available.clear()
+                yield from self._idle_available.wait()
+            worker = self._idle.popleft()
+            if worker.process.returncode is None:
+                return worker
+            self._start_task(self._replace(worker))
+
+    def put(self, worker, failed=False):
+        """Gives back a worker obtained with ``get``.
+
+        :param failed: The worker is in an unknown state, e.g. after a
+            timeout, and must be replaced.
+
+        """
+        if worker not in self._workers:
+            # pool stopped
+            return
+        if (failed or worker.process.returncode is not None
+                or (self.max_runs is not None
+                    and worker.runs >= self.max_runs)):
+            self._start_task(self._replace(worker))
+        else:
+            self._idle.append(worker)
+            self._idle_available.set()
+
+    @asyncio.coroutine
+    def stop(self):
+        """Terminates all the worker processes, including those that have
+        not been given back.
+
+        """
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            yield from asyncio.wait(self._tasks)
+        workers = self._workers
+        self._workers = set()
+        self._idle.clear()
+        for worker in workers:
+            yield from worker.end_process()
@@ -1,10 +1,13 @@
 import sys
+import time
+import threading
+import importlib
 from inspect import isclass
 import traceback
 
 from artiq.protocols import pyon
 from artiq.tools import file_import
-from artiq.language.db import AutoDB
+from artiq.language.db import AutoDB, Device
 from artiq.master.db import DBHub, ResultDB
 
 
@@ -13,11 +16,20 @@ def get_object():
     return pyon.decode(line)
 
 
+# Held updates of the realtime results are sent by a timer thread, which
+# must not interleave its output with that of the main thread.
+_output_lock = threading.RLock()
+
+
+def put_text(ds):
+    with _output_lock:
+        sys.__stdout__.write(ds)
+        sys.__stdout__.write("\n")
+        sys.__stdout__.flush()
+
+
 def put_object(obj):
-    ds = pyon.encode(obj)
-    sys.__stdout__.write(ds)
-    sys.__stdout__.write("\n")
-    sys.__stdout__.flush()
+    put_text(pyon.encode(obj))
 
 
 class ParentActionError(Exception):
@@ -27,6 +39,8 @@ class ParentActionError(Exception):
 def make_parent_action(action, argnames, exception=ParentActionError):
     argnames = argnames.split()
     def parent_action(*args):
+        # the parent must see the updates that happened before
+        flush_rt_results()
         request = {"action": action}
         for argname, arg in zip(argnames, args):
             request[argname] = arg
@@ -48,12 +62,61 @@ class ParentPDB:
     set = make_parent_action("set_parameter", "name value")
 
 
+acquire_devices = make_parent_action("acquire_devices", "names")
 init_rt_results = make_parent_action("init_rt_results", "description")
-update_rt_results = make_parent_action("update_rt_results", "mod")
+
+
+# Updates of the realtime results are sent without waiting for a reply.
+# An update is sent immediately if the previous ones were sent at least
+# this long ago; otherwise it is held with the following ones, and sent
+# with them once this many are pending, when that delay has passed, before
+# each parent action or at the end of the run, whichever comes first.
+rt_results_batch_size = 1000
+rt_results_batch_delay = 0.1
+
+# Mods are encoded when they are made, as they may refer to objects that
+# the experiment modifies later.
+_rt_results_mods = []
+_rt_results_last_flush = None
+_rt_results_timer = None
+
+
+def flush_rt_results():
+    global _rt_results_last_flush, _rt_results_timer
+    with _output_lock:
+        if _rt_results_timer is not None:
+            _rt_results_timer.cancel()
+            _rt_results_timer = None
+        if _rt_results_mods:
+            put_text("{\"action\": \"update_rt_results\", \"reply\": False, "
+                     "\"mods\": [" + ", ".join(_rt_results_mods) + "]}")
+            del _rt_results_mods[:]
+            _rt_results_last_flush = time.monotonic()
+
+
+def _flush_held_rt_results():
+    with _output_lock:
+        # the timer may have been replaced while this one waited for the lock
+        if _rt_results_timer is threading.current_thread():
+            flush_rt_results()
 
 
 def publish_rt_results(notifier, data):
-    update_rt_results(data)
+    global _rt_results_timer
+    with _output_lock:
+        _rt_results_mods.append(pyon.encode(data))
+        if _rt_results_last_flush is None:
+            delay = 0
+        else:
+            delay = (_rt_results_last_flush + rt_results_batch_delay
+                     - time.monotonic())
+        if len(_rt_results_mods) >= rt_results_batch_size or delay <= 0:
+            flush_rt_results()
+        elif _rt_results_timer is None:
+            _rt_results_timer = threading.Timer(delay,
+                                                _flush_held_rt_results)
+            _rt_results_timer.daemon = True
+            _rt_results_timer.start()
 
 
 def get_unit(file, unit):
@@ -71,9 +134,23 @@ def get_unit(file, unit):
         return getattr(module, unit)
 
 
+def get_devices(unit):
+    dbkeys = unit.DBKeys
+    devices = {k for k in dir(dbkeys)
+               if isinstance(getattr(dbkeys, k), Device)}
+    if getattr(dbkeys, "implicit_core", True):
+        devices.add("core")
+    return sorted(devices)
+
+
 def run(obj):
     unit = get_unit(obj["file"], obj["unit"])
 
+    devices = obj.get("devices")
+    if devices is None:
+        devices = get_devices(unit)
+    acquire_devices(devices)
+
     realtime_results = unit.realtime_results()
     init_rt_results(realtime_results)
 
@@ -93,19 +170,31 @@ def run(obj):
             unit_inst = unit(dbh, **obj["arguments"])
             unit_inst.run()
         except Exception:
+            flush_rt_results()
             put_object({"action": "report_completed",
                         "status": "failed",
                         "message": traceback.format_exc()})
         else:
+            flush_rt_results()
             put_object({"action": "report_completed",
                         "status": "ok"})
     finally:
         dbh.close()
 
 
+def preload(modules):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print("Failed to preload {}: {}".format(module, e))
+
+
 def main():
     sys.stdout = sys.stderr
 
+    preload(sys.argv[1:])
+    put_object("ready")
     while True:
         obj = get_object()
         put_object("ack")
@@ -1,9 +1,62 @@
 import asyncio
+import errno
+import os
+import socket
+import stat
 from copy import copy
 
 
+_unix_prefix = "unix:"
+
+
+def unix_socket_path(host):
+    """Returns the path of the Unix domain socket designated by a host of the
+    form ``unix:/path``, or ``None`` if the host is a TCP hostname or
+    address.
+
+    """
+    if host.startswith(_unix_prefix):
+        return host[len(_unix_prefix):]
+    else:
+        return None
+
+
+@asyncio.coroutine
+def open_connection(host, port):
+    """Equivalent of ``asyncio.open_connection`` that also accepts
+    ``unix:/path`` hosts, in which case the port is ignored.
+
+    """
+    path = unix_socket_path(host)
+    if path is None:
+        return (yield from asyncio.open_connection(host, port))
+    else:
+        return (yield from asyncio.open_unix_connection(path))
+
+
+def _remove_stale_socket(path):
+    # Removes a socket left at path by a server that no longer runs, and
+    # raises EADDRINUSE if a server still accepts connections on it.
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            pass
+        else:
+            raise OSError(errno.EADDRINUSE, "Address already in use: " + path)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
 class AsyncioServer:
-    """Generic TCP server based on asyncio.
+    """Generic TCP or Unix domain socket server based on asyncio.
 
     Users of this class must derive from it and define the
     ``_handle_connection_cr`` method and coroutine.
@@ -11,6 +64,8 @@ class AsyncioServer:
     """
     def __init__(self):
         self._client_tasks = set()
+        self._servers = []
+        self._unix_paths = []
 
     @asyncio.coroutine
     def start(self, host, port):
@@ -21,13 +76,26 @@ class AsyncioServer:
 
         This method is a `coroutine`.
 
+        It can be called several times to listen on several addresses.
+
         :param host: Bind address of the server (see ``asyncio.start_server``
-            from the Python standard library).
-        :param port: TCP port to bind to.
+            from the Python standard library), or ``unix:`` followed by the
+            path of a Unix domain socket to create. A stale socket left at
+            that path is removed first, while ``OSError`` is raised if
+            another server is listening on it.
+        :param port: TCP port to bind to. Ignored for Unix domain sockets.
 
         """
-        self.server = yield from asyncio.start_server(self._handle_connection,
-                                                      host, port)
+        path = unix_socket_path(host)
+        if path is None:
+            server = yield from asyncio.start_server(self._handle_connection,
+                                                     host, port)
+        else:
+            _remove_stale_socket(path)
+            server = yield from asyncio.start_unix_server(
+                self._handle_connection, path)
+            self._unix_paths.append(path)
+        self._servers.append(server)
 
     @asyncio.coroutine
     def stop(self):
@@ -42,9 +110,16 @@ class AsyncioServer:
                 yield from asyncio.wait_for(task, None)
             except asyncio.CancelledError:
                 pass
-        self.server.close()
-        yield from self.server.wait_closed()
-        del self.server
+        for server in self._servers:
+            server.close()
+            yield from server.wait_closed()
+        self._servers = []
+        for path in self._unix_paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self._unix_paths = []
 
     def _client_done(self, task):
         self._client_tasks.remove(task)
@@ -5,8 +5,9 @@ from artiq.protocols.sync_struct import Notifier
 
 
 class FlatFileDB:
-    def __init__(self, filename, default_data=None):
+    def __init__(self, filename, default_data=None, pack_lists=False):
         self.filename = filename
+        self.pack_lists = pack_lists
         try:
             data = pyon.load_file(self.filename)
         except FileNotFoundError:
@@ -18,7 +19,7 @@ class FlatFileDB:
         self.hooks = []
 
     def save(self):
-        pyon.store_file(self.filename, self.data.read)
+        pyon.store_file(self.filename, self.data.read, self.pack_lists)
 
     def request(self, name):
         return self.data.read[name]
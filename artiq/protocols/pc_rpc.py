@@ -13,11 +13,19 @@ client's list.
 """
 
 import socket
+import select
 import asyncio
+import threading
+import time
 import traceback
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import partial
 
 from artiq.protocols import pyon
-from artiq.protocols.asyncio_server import AsyncioServer as _AsyncioServer
+from artiq.protocols.sync_struct import Notifier
+from artiq.protocols.asyncio_server import (AsyncioServer as _AsyncioServer,
+                                            unix_socket_path, open_connection)
 
 
 class RemoteError(Exception):
@@ -39,6 +47,78 @@ class IncompatibleServer(Exception):
 _init_string = b"ARTIQ pc_rpc\n"
 
 
+class _SocketReader:
+    # Buffered reader for blocking sockets. Received data is accumulated in
+    # a bytearray that is only grown when a line does not fit into it.
+    def __init__(self, sock, bufsize=4096):
+        self.sock = sock
+        self.buf = bytearray(bufsize)
+        # unconsumed data is buf[start:end]
+        self.start = 0
+        self.end = 0
+
+    def _recv_into(self, buf, offset):
+        with memoryview(buf)[offset:] as view:
+            nbytes = self.sock.recv_into(view)
+        if not nbytes:
+            raise ConnectionError("Connection closed by server")
+        return nbytes
+
+    def _fill(self):
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            if self.start:
+                n = self.end - self.start
+                self.buf[:n] = self.buf[self.start:self.end]
+                self.start, self.end = 0, n
+            else:
+                self.buf.extend(bytes(len(self.buf)))
+        self.end += self._recv_into(self.buf, self.end)
+
+    def readline(self):
+        scanned = 0
+        while True:
+            i = self.buf.find(b"\n", self.start + scanned, self.end)
+            if i >= 0:
+                line = self.buf[self.start:i + 1]
+                self.start = i + 1
+                return line
+            scanned = self.end - self.start
+            self._fill()
+
+    def readexactly(self, n):
+        available = self.end - self.start
+        if available >= n:
+            r = self.buf[self.start:self.start + n]
+            self.start += n
+            return r
+        # receive the rest directly into the result
+        r = bytearray(n)
+        r[:available] = self.buf[self.start:self.end]
+        self.start = self.end = 0
+        while available < n:
+            available += self._recv_into(r, available)
+        return r
+
+
+def _batch_calls(calls):
+    # Normalizes (name[, args[, kwargs]]) tuples into the list of
+    # [name, args, kwargs] lists sent to the server.
+    r = []
+    for call in calls:
+        name, args, kwargs = (tuple(call) + ((), {})[len(call) - 1:])
+        r.append([name, tuple(args), kwargs])
+    return r
+
+
+@asyncio.coroutine
+def _read_frame(reader):
+    header = yield from reader.readexactly(pyon.frame_header_size)
+    body = yield from reader.readexactly(pyon.frame_body_length(header))
+    return pyon.decode_frame(header, body)
+
+
 class Client:
     """This class proxies the methods available on the server so that they
     can be used as if they were local methods.
@@ -54,14 +134,19 @@ class Client:
     Only methods are supported. Attributes must be accessed by providing and
     using "get" and/or "set" methods on the server side.
 
+    If the server supports it, messages are exchanged as binary PYON frames
+    (see ``pyon.encode_frame``) once the target is selected, so that Numpy
+    arrays are transferred without base64 encoding.
+
     At object initialization, the connection to the remote server is
     automatically attempted. The user must call ``close_rpc`` to
     free resources properly after initialization completes successfully.
 
     :param host: Identifier of the server. The string can represent a
         hostname or a IPv4 or IPv6 address (see
-        ``socket.create_connection`` in the Python standard library).
-    :param port: TCP port to use.
+        ``socket.create_connection`` in the Python standard library), or
+        ``unix:`` followed by the path of a Unix domain socket.
+    :param port: TCP port to use. Ignored for Unix domain sockets.
     :param target_name: Target name to select. ``IncompatibleServer`` is
         raised if the target does not exist.
         Use ``None`` to skip selecting a target. The list of targets can then
@@ -70,7 +155,18 @@ class Client:
 
     """
     def __init__(self, host, port, target_name):
-        self.__socket = socket.create_connection((host, port))
+        path = unix_socket_path(host)
+        if path is None:
+            self.__socket = socket.create_connection((host, port))
+        else:
+            self.__socket = socket.socket(socket.AF_UNIX)
+            try:
+                self.__socket.connect(path)
+            except:
+                self.__socket.close()
+                raise
+        self.__reader = _SocketReader(self.__socket)
+        self.__binary = False
 
         try:
             self.__socket.sendall(_init_string)
@@ -78,6 +174,7 @@ class Client:
             server_identification = self.__recv()
             self.__target_names = server_identification["targets"]
             self.__id_parameters = server_identification["parameters"]
+            self.__features = server_identification.get("features", [])
             if target_name is not None:
                 self.select_rpc_target(target_name)
         except:
@@ -92,6 +189,9 @@ class Client:
         if target_name not in self.__target_names:
             raise IncompatibleServer
         self.__socket.sendall((target_name + "\n").encode())
+        if "binary" in self.__features:
+            self.__send({"action": "binary"})
+            self.__binary = True
 
     def get_rpc_id(self):
         """Returns a tuple (target_names, id_parameters) containing the
@@ -100,6 +200,37 @@ class Client:
         """
         return (self.__target_names, self.__id_parameters)
 
+    def is_rpc_connected(self):
+        """Checks, without blocking, that the connection to the server has
+        not been closed.
+
+        """
+        if self.__reader.start != self.__reader.end:
+            # servers do not send unsolicited data
+            return False
+        readable, _, _ = select.select([self.__socket], [], [], 0)
+        return not readable
+
+    def ping_rpc(self, timeout=None):
+        """Checks that the server answers requests, with a request that does
+        not call the target. ``socket.timeout`` is raised if there is no
+        answer after ``timeout`` seconds; the connection must then be
+        closed.
+
+        With servers that do not support batched calls, this only checks
+        that the connection has not been closed.
+
+        """
+        if "batch" not in self.__features:
+            if not self.is_rpc_connected():
+                raise ConnectionError("Connection closed by server")
+            return
+        self.__socket.settimeout(timeout)
+        try:
+            self.__do_action({"action": "call_batch", "calls": []})
+        finally:
+            self.__socket.settimeout(None)
+
     def close_rpc(self):
         """Closes the connection to the RPC server.
 
@@ -109,20 +240,38 @@ class Client:
         self.__socket.close()
 
     def __send(self, obj):
-        line = pyon.encode(obj) + "\n"
-        self.__socket.sendall(line.encode())
+        if self.__binary:
+            for chunk in pyon.encode_frame(obj):
+                self.__socket.sendall(chunk)
+        else:
+            line = pyon.encode(obj) + "\n"
+            self.__socket.sendall(line.encode())
 
     def __recv(self):
-        buf = self.__socket.recv(4096).decode()
-        while "\n" not in buf:
-            more = self.__socket.recv(4096)
-            if not more:
-                break
-            buf += more.decode()
-        return pyon.decode(buf)
+        if self.__binary:
+            header = self.__reader.readexactly(pyon.frame_header_size)
+            body = self.__reader.readexactly(pyon.frame_body_length(header))
+            return pyon.decode_frame(header, body)
+        return pyon.decode(self.__reader.readline())
 
-    def __do_rpc(self, name, args, kwargs):
-        obj = {"action": "call", "name": name, "args": args, "kwargs": kwargs}
+    def call_rpc_batch(self, calls):
+        """Calls several RPC methods in order, and returns the list of their
+        results.
+
+        :param calls: Iterable of tuples ``(name, args, kwargs)``, where
+            ``args`` and ``kwargs`` are optional.
+
+        If the server supports it, all the calls are sent together and
+        answered with a single reply. Execution stops at the first method
+        that raises an exception, and ``RemoteError`` is raised.
+
+        """
+        calls = _batch_calls(calls)
+        if "batch" not in self.__features:
+            return [self.__do_rpc(*call) for call in calls]
+        return self.__do_action({"action": "call_batch", "calls": calls})
+
+    def __do_action(self, obj):
         self.__send(obj)
 
         obj = self.__recv()
@@ -133,6 +282,10 @@ class Client:
         else:
             raise ValueError
 
+    def __do_rpc(self, name, args, kwargs):
+        return self.__do_action({"action": "call", "name": name,
+                                 "args": args, "kwargs": kwargs})
+
     def __getattr__(self, name):
         def proxy(*args, **kwargs):
             return self.__do_rpc(name, args, kwargs)
@@ -145,6 +298,10 @@ class AsyncioClient:
 
     All RPC methods are coroutines.
 
+    If the server supports it, calls are pipelined: several calls (e.g. from
+    different tasks) can be in progress at the same time on the connection,
+    and their results are matched by request identifiers.
+
     """
     def __init__(self):
         self.__lock = asyncio.Lock()
@@ -152,6 +309,11 @@ class AsyncioClient:
         self.__writer = None
         self.__target_names = None
         self.__id_parameters = None
+        self.__features = []
+        self.__binary = False
+        self.__receive_task = None
+        self.__next_id = 0
+        self.__pending = dict()
 
     @asyncio.coroutine
     def connect_rpc(self, host, port, target_name):
@@ -161,12 +323,14 @@ class AsyncioClient:
 
         """
         self.__reader, self.__writer = \
-            yield from asyncio.open_connection(host, port)
+            yield from open_connection(host, port)
+        self.__binary = False
         try:
             self.__writer.write(_init_string)
             server_identification = yield from self.__recv()
             self.__target_names = server_identification["targets"]
             self.__id_parameters = server_identification["parameters"]
+            self.__features = server_identification.get("features", [])
             if target_name is not None:
                 self.select_rpc_target(target_name)
         except:
@@ -181,6 +345,11 @@ class AsyncioClient:
         if target_name not in self.__target_names:
             raise IncompatibleServer
         self.__writer.write((target_name + "\n").encode())
+        if "binary" in self.__features:
+            self.__send({"action": "binary"})
+            self.__binary = True
+            if "pipeline" in self.__features:
+                self.__receive_task = asyncio.Task(self.__receive_cr())
 
     def get_rpc_id(self):
         """Returns a tuple (target_names, id_parameters) containing the
@@ -189,12 +358,38 @@ class AsyncioClient:
         """
         return (self.__target_names, self.__id_parameters)
 
+    def is_rpc_connected(self):
+        """Checks that the connection to the server has not been closed.
+
+        """
+        if self.__reader is None or self.__reader.at_eof():
+            return False
+        if self.__receive_task is not None and self.__receive_task.done():
+            return False
+        return True
+
+    @asyncio.coroutine
+    def ping_rpc(self):
+        """Checks that the server answers requests. See
+        ``Client.ping_rpc``; use ``asyncio.wait_for`` for a timeout.
+
+        """
+        if "batch" not in self.__features:
+            if not self.is_rpc_connected():
+                raise ConnectionError("Connection closed by server")
+            return
+        yield from self.__do_action({"action": "call_batch", "calls": []})
+
     def close_rpc(self):
         """Closes the connection to the RPC server.
 
         No further method calls should be done after this method is called.
 
         """
+        if self.__receive_task is not None:
+            self.__receive_task.cancel()
+            self.__receive_task = None
+        self.__fail_pending()
         self.__writer.close()
         self.__reader = None
         self.__writer = None
@@ -202,31 +397,89 @@ class AsyncioClient:
         self.__id_parameters = None
 
     def __send(self, obj):
-        line = pyon.encode(obj) + "\n"
-        self.__writer.write(line.encode())
+        if self.__binary:
+            self.__writer.writelines(pyon.encode_frame(obj))
+        else:
+            line = pyon.encode(obj) + "\n"
+            self.__writer.write(line.encode())
 
     @asyncio.coroutine
     def __recv(self):
+        if self.__binary:
+            return (yield from _read_frame(self.__reader))
         line = yield from self.__reader.readline()
         return pyon.decode(line.decode())
 
+    def __fail_pending(self):
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_exception(
+                    ConnectionError("Connection closed by server"))
+        self.__pending = dict()
+
     @asyncio.coroutine
-    def __do_rpc(self, name, args, kwargs):
-        yield from self.__lock.acquire()
+    def __receive_cr(self):
         try:
-            obj = {"action": "call", "name": name,
-                   "args": args, "kwargs": kwargs}
-            self.__send(obj)
-
-            obj = yield from self.__recv()
-            if obj["status"] == "ok":
-                return obj["ret"]
-            elif obj["status"] == "failed":
-                raise RemoteError(obj["message"])
-            else:
-                raise ValueError
+            while True:
+                try:
+                    obj = yield from self.__recv()
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                future = self.__pending.pop(obj["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(obj)
         finally:
-            self.__lock.release()
+            self.__fail_pending()
+
+    @asyncio.coroutine
+    def call_rpc_batch(self, calls):
+        """Calls several RPC methods in order. See
+        ``Client.call_rpc_batch``.
+
+        """
+        calls = _batch_calls(calls)
+        if "batch" not in self.__features:
+            r = []
+            for call in calls:
+                r.append((yield from self.__do_rpc(*call)))
+            return r
+        return (yield from self.__do_action({"action": "call_batch",
+                                             "calls": calls}))
+
+    @asyncio.coroutine
+    def __do_rpc(self, name, args, kwargs):
+        return (yield from self.__do_action({"action": "call", "name": name,
+                                             "args": args, "kwargs": kwargs}))
+
+    @asyncio.coroutine
+    def __do_action(self, obj):
+        if self.__receive_task is not None:
+            if self.__receive_task.done():
+                raise ConnectionError("Connection closed by server")
+            request_id = self.__next_id
+            self.__next_id += 1
+            obj["id"] = request_id
+            future = asyncio.Future()
+            self.__pending[request_id] = future
+            try:
+                self.__send(obj)
+                obj = yield from future
+            finally:
+                self.__pending.pop(request_id, None)
+        else:
+            yield from self.__lock.acquire()
+            try:
+                self.__send(obj)
+                obj = yield from self.__recv()
+            finally:
+                self.__lock.release()
+
+        if obj["status"] == "ok":
+            return obj["ret"]
+        elif obj["status"] == "failed":
+            raise RemoteError(obj["message"])
+        else:
+            raise ValueError
 
     def __getattr__(self, name):
         @asyncio.coroutine
@@ -235,6 +488,242 @@ class AsyncioClient:
         return proxy
 
 
+class ClientPool:
+    """Keeps connections (``Client`` objects) to RPC servers open for reuse,
+    to avoid the cost of connecting and selecting the target at each use.
+    A single pool is meant to be shared by the whole process.
+
+    Connections are identified by ``(host, port, target_name)``. Idle
+    connections that the server has closed (e.g. because it was restarted)
+    are detected when they are taken from the pool, and replaced by new
+    ones. Connection attempts that fail are retried ``retries`` times,
+    after delays that start at ``min_backoff`` seconds and double up to
+    ``max_backoff`` seconds.
+
+    :param max_idle: Maximum number of idle connections kept for each
+        ``(host, port, target_name)``. Others are closed when returned.
+
+    This class is thread-safe.
+
+    """
+    def __init__(self, max_idle=2, retries=3, min_backoff=0.1,
+                 max_backoff=2.0):
+        self.max_idle = max_idle
+        self.retries = retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        # key -> list of idle clients
+        self._idle = dict()
+        # client -> key, for the clients in use
+        self._in_use = dict()
+
+    def _connect(self, key):
+        delay = self.min_backoff
+        for attempt in range(self.retries):
+            try:
+                return Client(*key)
+            except OSError:
+                pass
+            time.sleep(delay)
+            delay = min(2*delay, self.max_backoff)
+        return Client(*key)
+
+    def get(self, host, port, target_name):
+        """Returns a connection to the given server and target, which must
+        be given back with ``put`` after use.
+
+        """
+        key = (host, port, target_name)
+        client = None
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate = idle.pop()
+                if candidate.is_rpc_connected():
+                    client = candidate
+                    break
+                candidate.close_rpc()
+        if client is None:
+            client = self._connect(key)
+        with self._lock:
+            self._in_use[client] = key
+        return client
+
+    def put(self, client, discard=False):
+        """Gives back a connection obtained with ``get``. If ``discard``
+        is true (e.g. after a connection error), the connection is closed
+        instead of being kept for reuse.
+
+        """
+        with self._lock:
+            key = self._in_use.pop(client)
+            idle = self._idle.setdefault(key, [])
+            if not discard and len(idle) < self.max_idle:
+                idle.append(client)
+                return
+        client.close_rpc()
+
+    @contextmanager
+    def client(self, host, port, target_name):
+        """Context manager that obtains a connection with ``get`` and gives
+        it back when leaving the block. The connection is discarded if the
+        block raises ``OSError`` (which includes connection errors).
+
+        """
+        client = self.get(host, port, target_name)
+        try:
+            yield client
+        except OSError:
+            self.put(client, discard=True)
+            raise
+        except:
+            self.put(client)
+            raise
+        else:
+            self.put(client)
+
+    def health_check(self, host, port, target_name, timeout=5.0):
+        """Verifies that the server answers requests (see
+        ``Client.ping_rpc``), and returns its identification information
+        (see ``Client.get_rpc_id``). The connection is discarded if the
+        server does not answer within ``timeout`` seconds.
+
+        """
+        with self.client(host, port, target_name) as client:
+            client.ping_rpc(timeout)
+            return client.get_rpc_id()
+
+    def close(self):
+        """Closes the idle connections. The connections in use are closed
+        when they are given back.
+
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = dict()
+            self.max_idle = 0
+        for clients in idle.values():
+            for client in clients:
+                client.close_rpc()
+
+
+class AsyncioClientPool:
+    """Equivalent of ``ClientPool`` for ``AsyncioClient``.
+
+    As ``AsyncioClient`` objects can be used by several tasks at the same
+    time (see pipelining in ``AsyncioClient``), the pool keeps a single
+    connection for each ``(host, port, target_name)``, which is shared by
+    all users and is replaced when the server closes it. Connections are
+    not given back after use.
+
+    """
+    def __init__(self, retries=3, min_backoff=0.1, max_backoff=2.0):
+        self.retries = retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._clients = dict()
+        self._locks = dict()
+
+    @asyncio.coroutine
+    def _connect(self, key):
+        delay = self.min_backoff
+        for attempt in range(self.retries + 1):
+            client = AsyncioClient()
+            try:
+                yield from client.connect_rpc(*key)
+            except OSError:
+                if attempt == self.retries:
+                    raise
+            else:
+                return client
+            yield from asyncio.sleep(delay)
+            delay = min(2*delay, self.max_backoff)
+
+    @asyncio.coroutine
+    def get(self, host, port, target_name):
+        """Returns a connection to the given server and target, connecting
+        to it if needed.
+
+        """
+        key = (host, port, target_name)
+        client = self._clients.get(key)
+        if client is not None and client.is_rpc_connected():
+            return client
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        yield from lock.acquire()
+        try:
+            client = self._clients.get(key)
+            if client is not None:
+                if client.is_rpc_connected():
+                    return client
+                del self._clients[key]
+                client.close_rpc()
+            client = yield from self._connect(key)
+            self._clients[key] = client
+            return client
+        finally:
+            lock.release()
+
+    def discard(self, client):
+        """Closes a connection obtained with ``get`` (e.g. after an error),
+        so that the next ``get`` opens a new one.
+
+        """
+        for key, c in list(self._clients.items()):
+            if c is client:
+                del self._clients[key]
+        client.close_rpc()
+
+    @asyncio.coroutine
+    def health_check(self, host, port, target_name, timeout=5.0):
+        """Verifies that the server answers requests, and returns its
+        identification information. See ``ClientPool.health_check``.
+
+        """
+        client = yield from self.get(host, port, target_name)
+        try:
+            yield from asyncio.wait_for(client.ping_rpc(), timeout)
+        except (OSError, asyncio.TimeoutError):
+            self.discard(client)
+            raise
+        return client.get_rpc_id()
+
+    def close(self):
+        """Closes all the connections.
+
+        """
+        clients = self._clients
+        self._clients = dict()
+        for client in clients.values():
+            client.close_rpc()
+
+
+#: Name of the introspection target added by ``Server``.
+stats_target_name = "rpc_stats"
+
+#: Upper bounds, in seconds, of the buckets of the call latency histograms
+#: kept by ``Server``. A last bucket counts the calls slower than all bounds.
+latency_buckets = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0)
+
+
+class _StatsTarget:
+    def __init__(self, server):
+        self.server = server
+
+    def get_latency_buckets(self):
+        """Returns the upper bounds of the latency histogram buckets."""
+        return latency_buckets
+
+    def get_stats(self):
+        """Returns the statistics of all targets."""
+        return self.server.stats.read
+
+    def reset_stats(self):
+        """Sets all counters to zero."""
+        self.server.reset_stats()
+
+
 class Server(_AsyncioServer):
     """This class creates a TCP server that handles requests coming from
     ``Client`` objects.
@@ -245,17 +734,102 @@ class Server(_AsyncioServer):
     simple cases: it allows new connections to be be accepted even when the
     previous client failed to properly shut down its connection.
 
+    Clients that support it are switched to binary PYON frames after target
+    selection; other clients keep using one PYON text line per message.
+
+    Clients can also send a batch of calls, which are executed in order
+    until one of them fails, and answered with a single reply.
+
+    RPC methods may be coroutines, in which case the server waits for their
+    completion before replying. Calls that carry a request identifier
+    (``id``) are processed concurrently, and their replies, which carry the
+    same identifier, are sent as soon as they are available and possibly out
+    of order. Other calls are processed and answered one after the other.
+
+    The server keeps statistics about the calls in its ``stats`` attribute,
+    a ``sync_struct.Notifier`` holding a dictionary with one entry per
+    target: ::
+
+        {"bytes_in": 0, "bytes_out": 0, "invalid_calls": 0,
+         "methods": {"name": {"calls": 0, "errors": 0, "time": 0.0,
+                              "latency": [0, ...]}}}
+
+    ``bytes_in`` and ``bytes_out`` count the requests and replies after
+    target selection, ``invalid_calls`` the calls of methods that do not
+    exist, ``time`` is the total time spent in each method and ``latency``
+    the histogram of the durations of the calls (see ``latency_buckets``).
+    The durations include the time spent waiting for the executor.
+    Calls of a batch are accounted for individually.
+
+    The statistics are also available to clients through the built-in
+    ``rpc_stats`` target, which always runs in the event loop.
+
     :param targets: A dictionary of objects providing the RPC methods to be
         exposed to the client. Keys are names identifying each object.
         Clients select one of these objects using its name upon connection.
     :param id_parameters: An optional human-readable string giving more
         information about the parameters of the server.
+    :param executor: An optional ``concurrent.futures.Executor`` in which
+        RPC methods that are not coroutines are run, so that slow methods
+        (e.g. blocking I/O with a device) do not stall the other connections.
+        By default, they are run in the event loop.
+    :param serialize: When an executor is used, run the calls to a given
+        target one at a time, in the order in which they are received. This
+        is required for targets that are not thread-safe.
+    :param stats: An optional ``sync_struct.Notifier`` encapsulating an
+        empty dictionary, in which the statistics are kept. This allows
+        publishing them with a ``sync_struct.Publisher``.
 
     """
-    def __init__(self, targets, id_parameters=None):
+    def __init__(self, targets, id_parameters=None, executor=None,
+                 serialize=True, stats=None):
         _AsyncioServer.__init__(self)
-        self.targets = targets
+        if stats_target_name in targets:
+            raise ValueError("Target name '{}' is reserved"
+                             .format(stats_target_name))
+        self.targets = dict(targets)
+        self.targets[stats_target_name] = _StatsTarget(self)
         self.id_parameters = id_parameters
+        self.executor = executor
+        self.serialize = serialize
+        self._locks = {k: asyncio.Lock() for k in self.targets.keys()}
+        if stats is None:
+            stats = Notifier(dict())
+        self.stats = stats
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Sets all the counters of ``stats`` to zero."""
+        for target_name in self.targets.keys():
+            self.stats[target_name] = {
+                "bytes_in": 0,
+                "bytes_out": 0,
+                "invalid_calls": 0,
+                "methods": dict()
+            }
+
+    def _record_count(self, target_name, key, n):
+        target_stats = self.stats[target_name]
+        target_stats[key] = target_stats.read[key] + n
+
+    def _record_call(self, target_name, name, t0, ok):
+        latency = time.monotonic() - t0
+        methods = self.stats[target_name]["methods"]
+        if name not in methods.read:
+            methods[name] = {
+                "calls": 0,
+                "errors": 0,
+                "time": 0.0,
+                "latency": [0]*(len(latency_buckets) + 1)
+            }
+        method = methods[name]
+        method_stats = method.read
+        method["calls"] = method_stats["calls"] + 1
+        if not ok:
+            method["errors"] = method_stats["errors"] + 1
+        method["time"] = method_stats["time"] + latency
+        bucket = bisect_left(latency_buckets, latency)
+        method["latency"][bucket] = method_stats["latency"][bucket] + 1
 
     @asyncio.coroutine
     def _handle_connection_cr(self, reader, writer):
@@ -266,7 +840,8 @@ class Server(_AsyncioServer):
 
             obj = {
                 "targets": sorted(self.targets.keys()),
-                "parameters": self.id_parameters
+                "parameters": self.id_parameters,
+                "features": ["binary", "pipeline", "batch"]
             }
             line = pyon.encode(obj) + "\n"
             writer.write(line.encode())
@@ -279,25 +854,143 @@ class Server(_AsyncioServer):
             except KeyError:
                 return
 
-            while True:
-                line = yield from reader.readline()
-                if not line:
-                    break
-                obj = pyon.decode(line.decode())
-                try:
-                    method = getattr(target, obj["name"])
-                    ret = method(*obj["args"], **obj["kwargs"])
-                    obj = {"status": "ok", "ret": ret}
-                except Exception:
-                    obj = {"status": "failed",
-                           "message": traceback.format_exc()}
-                line = pyon.encode(obj) + "\n"
-                writer.write(line.encode())
+            binary = False
+            tasks = set()
+            try:
+                while True:
+                    if binary:
+                        try:
+                            header = yield from reader.readexactly(
+                                pyon.frame_header_size)
+                            body = yield from reader.readexactly(
+                                pyon.frame_body_length(header))
+                        except asyncio.IncompleteReadError:
+                            break
+                        self._record_count(target_name, "bytes_in",
+                                           len(header) + len(body))
+                        obj = pyon.decode_frame(header, body)
+                    else:
+                        line = yield from reader.readline()
+                        if not line:
+                            break
+                        self._record_count(target_name, "bytes_in",
+                                           len(line))
+                        obj = pyon.decode(line.decode())
+                    if obj["action"] == "binary":
+                        binary = True
+                        continue
+                    reply = self._process_action(target_name, target, obj)
+                    if not asyncio.iscoroutine(reply):
+                        self._send_reply(writer, binary, target_name, obj, reply)
+                    elif "id" in obj:
+                        task = asyncio.Task(self._reply_when_done(
+                            writer, binary, target_name, obj, reply))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    else:
+                        yield from self._reply_when_done(
+                            writer, binary, target_name, obj, reply)
+            finally:
+                for task in tasks:
+                    task.cancel()
         finally:
             writer.close()
 
+    def _process_action(self, target_name, target, obj):
+        # Returns the reply, or a coroutine returning it if a method
+        # is a coroutine or is run in the executor.
+        if obj["action"] == "call_batch":
+            return self._process_batch(target_name, target, obj["calls"])
+        return self._process_call(target_name, target,
+                                  obj["name"], obj["args"], obj["kwargs"])
+
+    @asyncio.coroutine
+    def _process_batch(self, target_name, target, calls):
+        results = []
+        for i, (name, args, kwargs) in enumerate(calls):
+            reply = self._process_call(target_name, target,
+                                       name, args, kwargs)
+            if asyncio.iscoroutine(reply):
+                reply = yield from reply
+            if reply["status"] != "ok":
+                reply["message"] = ("Call {} ({}) of batch failed:\n"
+                                    .format(i, name) + reply["message"])
+                return reply
+            results.append(reply["ret"])
+        return {"status": "ok", "ret": results}
+
+    def _process_call(self, target_name, target, name, args, kwargs):
+        try:
+            method = getattr(target, name)
+        except Exception:
+            self._record_count(target_name, "invalid_calls", 1)
+            return {"status": "failed", "message": traceback.format_exc()}
+        record = partial(self._record_call, target_name, name,
+                         time.monotonic())
+        try:
+            if (self.executor is not None
+                    and target_name != stats_target_name
+                    and not asyncio.iscoroutinefunction(method)):
+                return self._wait_result(self._run_in_executor(
+                    target_name, partial(method, *args, **kwargs)), record)
+            ret = method(*args, **kwargs)
+        except Exception:
+            record(False)
+            return {"status": "failed", "message": traceback.format_exc()}
+        if asyncio.iscoroutine(ret) or isinstance(ret, asyncio.Future):
+            return self._wait_result(ret, record)
+        record(True)
+        return {"status": "ok", "ret": ret}
+
+    @asyncio.coroutine
+    def _run_in_executor(self, target_name, f):
+        loop = asyncio.get_event_loop()
+        if not self.serialize:
+            return (yield from loop.run_in_executor(self.executor, f))
+        lock = self._locks[target_name]
+        yield from lock.acquire()
+        try:
+            future = loop.run_in_executor(self.executor, f)
+        except:
+            lock.release()
+            raise
+        # The call keeps running in its thread when the caller is cancelled,
+        # e.g. when the client disconnects: only release the lock once the
+        # call is completed.
+        future.add_done_callback(lambda future: lock.release())
+        return (yield from asyncio.shield(future))
+
+    @asyncio.coroutine
+    def _wait_result(self, ret, record):
+        try:
+            ret = yield from ret
+        except Exception:
+            record(False)
+            return {"status": "failed", "message": traceback.format_exc()}
+        record(True)
+        return {"status": "ok", "ret": ret}
+
+    @asyncio.coroutine
+    def _reply_when_done(self, writer, binary, target_name, obj, reply):
+        reply = yield from reply
+        self._send_reply(writer, binary, target_name, obj, reply)
+
+    def _send_reply(self, writer, binary, target_name, obj, reply):
+        if "id" in obj:
+            reply["id"] = obj["id"]
+        if binary:
+            data = pyon.encode_frame(reply)
+            writer.writelines(data)
+            self._record_count(target_name, "bytes_out",
+                               sum(len(b) for b in data))
+        else:
+            data = (pyon.encode(reply) + "\n").encode()
+            writer.write(data)
+            self._record_count(target_name, "bytes_out", len(data))
+
 
-def simple_server_loop(targets, host, port, id_parameters=None):
+def simple_server_loop(targets, host, port, id_parameters=None,
+                       executor=None, serialize=True):
     """Runs a server until an exception is raised (e.g. the user hits Ctrl-C).
 
     See ``Server`` for a description of the parameters.
@@ -305,7 +998,7 @@ def simple_server_loop(targets, host, port, id_parameters=None):
     """
     loop = asyncio.get_event_loop()
     try:
-        server = Server(targets, id_parameters)
+        server = Server(targets, id_parameters, executor, serialize)
         loop.run_until_complete(server.start(host, port))
         try:
             loop.run_forever()
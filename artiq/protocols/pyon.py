@@ -9,16 +9,31 @@ objects. Its main features are:
 * Those data types are accurately reconstructed (unlike JSON where e.g. tuples
   become lists, and dictionary keys are turned into strings).
 * Supports Numpy arrays.
+* Long lists of integers or floats can optionally be packed into a compact
+  binary representation, and are decoded back into lists.
 
 The main rationale for this new custom serializer (instead of using JSON) is
 that JSON does not support Numpy and more generally cannot be extended with
 other data types while keeping a concise syntax. Here we can use the Python
 function call syntax to mark special data types.
 
+Decoding does not use ``eval``: a dedicated parser accepts only the subset of
+the Python syntax that the encoder produces, which makes it safe to use on
+untrusted input. It decodes small and medium messages (RPC calls, the
+parameter database) about as fast as ``eval``, and large ones, such as long
+lists of results, faster.
+
 """
 
 
+import os
+import stat
+import mmap
 import base64
+import re
+import ast
+import struct
+from functools import partial
 from fractions import Fraction
 
 import numpy
@@ -40,91 +55,277 @@ _encode_map = {
     numpy.ndarray: "nparray"
 }
 
-class _Encoder:
-    def __init__(self, pretty):
-        self.pretty = pretty
-        self.indent_level = 0
+_numeric_types = {int, float}
 
-    def indent(self):
-        return "    "*self.indent_level
+# Homogeneous numeric lists at least this long are packed when requested.
+_pack_min_length = 16
+_pack_dtypes = {int: "int64", float: "float64"}
+
+_str_translation = {ord("\""): "\\\"", ord("\\"): "\\\\", ord("\n"): "\\n"}
+
+
+class _Encoder:
+    # The output is accumulated in a list of string chunks that is joined
+    # once at the end. Encoding functions are looked up by type in the
+    # class' _dispatch table, built by _build_dispatch below.
+    def __init__(self, buffers=None, pack_lists=False):
+        self.chunks = []
+        # In binary mode, Numpy array contents are appended to this list
+        # instead of being base64-encoded into the text.
+        self.buffers = buffers
+        self.buffers_size = 0
+        self.pack_lists = pack_lists
 
     def encode_none(self, x):
-        return "null"
+        self.chunks.append("null")
 
     def encode_bool(self, x):
         if x:
-            return "true"
+            self.chunks.append("true")
         else:
-            return "false"
+            self.chunks.append("false")
 
     def encode_number(self, x):
-        return str(x)
+        self.chunks.append(str(x))
 
     def encode_str(self, x):
-        tt = {ord("\""): "\\\"", ord("\\"): "\\\\", ord("\n"): "\\n"}
-        return "\"" + x.translate(tt) + "\""
+        self.chunks.append("\"" + x.translate(_str_translation) + "\"")
 
     def encode_tuple(self, x):
+        chunks = self.chunks
+        dispatch = self._dispatch
+        chunks.append("(")
+        for item in x:
+            dispatch[type(item)](self, item)
+            chunks.append(", ")
         if len(x) == 1:
-            return "(" + self.encode(x[0]) + ", )"
+            chunks[-1] = ", )"
+        elif x:
+            chunks[-1] = ")"
         else:
-            r = "("
-            r += ", ".join([self.encode(item) for item in x])
-            r += ")"
-            return r
+            chunks.append(")")
 
     def encode_list(self, x):
-        r = "["
-        r += ", ".join([self.encode(item) for item in x])
-        r += "]"
-        return r
+        chunks = self.chunks
+        if x:
+            types = set(map(type, x))
+            if types <= _numeric_types:
+                # fast path for homogeneous numeric lists such as results
+                if (self.pack_lists and len(x) >= _pack_min_length
+                        and len(types) == 1):
+                    try:
+                        a = numpy.array(x, dtype=_pack_dtypes[types.pop()])
+                    except OverflowError:
+                        pass
+                    else:
+                        chunks.append("packedlist(")
+                        self.encode_nparray(a)
+                        chunks.append(")")
+                        return
+                chunks.append("[" + ", ".join(map(str, x)) + "]")
+                return
+        dispatch = self._dispatch
+        chunks.append("[")
+        for item in x:
+            dispatch[type(item)](self, item)
+            chunks.append(", ")
+        if x:
+            chunks[-1] = "]"
+        else:
+            chunks.append("]")
 
     def encode_dict(self, x):
-        r = "{"
-        if not self.pretty or len(x) < 2:
-            r += ", ".join([self.encode(k) + ": " + self.encode(v)
-                           for k, v in x.items()])
+        chunks = self.chunks
+        dispatch = self._dispatch
+        chunks.append("{")
+        for k, v in x.items():
+            dispatch[type(k)](self, k)
+            chunks.append(": ")
+            dispatch[type(v)](self, v)
+            chunks.append(", ")
+        if x:
+            chunks[-1] = "}"
         else:
-            self.indent_level += 1
-            r += "\n"
-            first = True
-            for k, v in x.items():
-                if not first:
-                    r += ",\n"
-                first = False
-                r += self.indent() + self.encode(k) + ": " + self.encode(v)
-            r += "\n"  # no ','
-            self.indent_level -= 1
-            r += self.indent()
-        r += "}"
-        return r
+            chunks.append("}")
 
     def encode_fraction(self, x):
-        return "Fraction({}, {})".format(encode(x.numerator),
-                                         encode(x.denominator))
+        self.chunks.append("Fraction(")
+        self.encode(x.numerator)
+        self.chunks.append(", ")
+        self.encode(x.denominator)
+        self.chunks.append(")")
 
     def encode_quantity(self, x):
-        return "Quantity({}, {})".format(encode(x.amount),
-                                         encode(x.unit))
+        self.chunks.append("Quantity(")
+        self.encode(x.amount)
+        self.chunks.append(", ")
+        self.encode(x.unit)
+        self.chunks.append(")")
 
     def encode_nparray(self, x):
-        r = "nparray("
-        r += encode(x.shape) + ", "
-        r += encode(str(x.dtype)) + ", "
-        r += encode(base64.b64encode(x).decode())
-        r += ")"
-        return r
+        if self.buffers is not None:
+            self.encode_ndbuffer(x)
+            return
+        self.chunks.append("nparray(")
+        self.encode(x.shape)
+        self.chunks.append(", ")
+        self.encode(str(x.dtype))
+        self.chunks.append(", ")
+        self.encode(base64.b64encode(x).decode())
+        self.chunks.append(")")
+
+    def encode_ndbuffer(self, x):
+        data = memoryview(numpy.ascontiguousarray(x).reshape(-1)
+                          .view(numpy.uint8))
+        self.chunks.append("ndbuffer(")
+        self.encode(x.shape)
+        self.chunks.append(", ")
+        self.encode(str(x.dtype))
+        self.chunks.append(", ")
+        self.encode(self.buffers_size)
+        self.chunks.append(")")
+        self.buffers.append(data)
+        self.buffers_size += len(data)
+        padding = _padding(len(data))
+        if padding:
+            self.buffers.append(bytes(padding))
+            self.buffers_size += padding
 
     def encode(self, x):
-        return getattr(self, "encode_" + _encode_map[type(x)])(x)
+        self._dispatch[type(x)](self, x)
+
+    def get_output(self):
+        return "".join(self.chunks)
+
+
+class _PrettyEncoder(_Encoder):
+    # Only used for files, where readability matters more than speed.
+    def __init__(self, pack_lists=False, write=None):
+        _Encoder.__init__(self, pack_lists=pack_lists)
+        self.indent_level = 0
+        self.write = write
 
+    def indent(self):
+        return "    "*self.indent_level
+
+    def flush(self):
+        # When writing to a file, pass on the output accumulated so far.
+        # This is only called between items of containers, where the
+        # encoding functions do not refer to previous chunks.
+        chunks = self.chunks
+        if self.write is not None and chunks \
+                and (len(chunks) >= 1024 or len(chunks[-1]) >= 65536):
+            self.write("".join(self.chunks))
+            self.chunks.clear()
+
+    def encode_list(self, x):
+        _Encoder.encode_list(self, x)
+        self.flush()
 
-def encode(x, pretty=False):
+    def encode_dict(self, x):
+        if len(x) < 2:
+            _Encoder.encode_dict(self, x)
+            return
+        chunks = self.chunks
+        self.indent_level += 1
+        chunks.append("{\n")
+        first = True
+        for k, v in x.items():
+            if not first:
+                chunks.append(",\n")
+            first = False
+            chunks.append(self.indent())
+            self.encode(k)
+            chunks.append(": ")
+            self.encode(v)
+            self.flush()
+        chunks.append("\n")  # no ','
+        self.indent_level -= 1
+        chunks.append(self.indent())
+        chunks.append("}")
+
+
+def _build_dispatch(cls):
+    cls._dispatch = {t: getattr(cls, "encode_" + name)
+                     for t, name in _encode_map.items()}
+
+_build_dispatch(_Encoder)
+_build_dispatch(_PrettyEncoder)
+
+
+def encode(x, pretty=False, pack_lists=False):
     """Serializes a Python object and returns the corresponding string in
     Python syntax.
 
+    :param pretty: Insert line breaks and indentation into dictionaries.
+    :param pack_lists: Encode long lists made only of integers (that fit in
+        64 bits) or only of floats as ``packedlist`` objects holding their
+        raw binary contents. This is smaller and faster to decode, but not
+        understood by older versions of this module.
+
+    """
+    if pretty:
+        encoder = _PrettyEncoder(pack_lists)
+    else:
+        encoder = _Encoder(pack_lists=pack_lists)
+    encoder.encode(x)
+    return encoder.get_output()
+
+
+def _padding(n):
+    # frame sections are aligned on 8 bytes so that arrays wrapped in place
+    # by the receiver are aligned as well
+    return -n % 8
+
+
+_frame_header = struct.Struct("!II")
+frame_header_size = _frame_header.size
+
+
+def encode_frame(x, pack_lists=False):
+    """Serializes a Python object into a binary frame.
+
+    A frame is made of a fixed-size header giving the lengths of the two
+    following sections, the object serialized in PYON text, and a payload
+    section holding the raw contents of all Numpy arrays, which the text
+    refers to by offset. This avoids the size and copy overheads of the
+    base64 encoding used by ``encode``.
+
+    Returns a list of bytes-like objects to be sent in order. Array contents
+    are not copied. See ``encode`` for the ``pack_lists`` parameter.
+
     """
-    return _Encoder(pretty).encode(x)
+    encoder = _Encoder([], pack_lists)
+    encoder.encode(x)
+    text = encoder.get_output().encode()
+    text += b" "*_padding(len(text))
+    header = _frame_header.pack(len(text), encoder.buffers_size)
+    return [header, text] + encoder.buffers
+
+
+def frame_body_length(header):
+    """Returns the number of bytes that follow the given frame header
+    (of length ``frame_header_size``) in a binary frame.
+
+    """
+    text_length, payload_length = _frame_header.unpack(header)
+    return text_length + payload_length
+
+
+def decode_frame(header, body):
+    """Parses a binary frame produced by ``encode_frame``, given as its
+    header and the ``frame_body_length(header)`` bytes that follow it.
+
+    Numpy arrays are wrapped around ``body`` without copying.
+
+    """
+    text_length, payload_length = _frame_header.unpack(header)
+    body = memoryview(body)
+    if len(body) != text_length + payload_length:
+        raise ValueError("Incorrect binary frame length")
+    functions = dict(_functions)
+    functions["ndbuffer"] = partial(_ndbuffer, body[text_length:])
+    return _decode(str(body[:text_length], "utf-8"), functions)
 
 
 def _nparray(shape, dtype, data):
@@ -132,39 +333,312 @@ def _nparray(shape, dtype, data):
     return a.reshape(shape)
 
 
-_eval_dict = {
-    "__builtins__": None,
+def _packedlist(a):
+    if not isinstance(a, numpy.ndarray) or a.ndim != 1:
+        raise ValueError("packedlist requires a one-dimensional array")
+    return a.tolist()
 
+
+def _ndbuffer(payload, shape, dtype, offset):
+    count = 1
+    for n in shape:
+        count *= n
+    a = numpy.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+    return a.reshape(shape)
+
+
+_constants = {
     "null": None,
     "false": False,
     "true": True,
+    "None": None,
+    "False": False,
+    "True": True
+}
 
+_functions = {
     "Fraction": Fraction,
     "Quantity": Quantity,
-    "nparray": _nparray
+    "nparray": _nparray,
+    "packedlist": _packedlist
+}
+
+_token_pattern = r"""
+    \s*
+    (?:
+        (?P<float>[-+]?(?:(?:\d+\.\d*|\.\d+)(?:[eE][-+]?\d+)?
+                          |\d+[eE][-+]?\d+|(?:inf|nan)\b))
+      | (?P<int>[-+]?\d+)
+      | (?P<str>"[^"\\]*(?:\\.[^"\\]*)*"|'[^'\\]*(?:\\.[^'\\]*)*')
+      | (?P<call>[A-Za-z_]\w*)\s*\(
+      | (?P<name>[A-Za-z_]\w*)
+      | (?P<punct>[\[\](){},:])
+    )"""
+_token_re = re.compile(_token_pattern, re.VERBOSE | re.DOTALL)
+_trailing_re = re.compile(r"\s*")
+# for parsing bytes-like objects such as memory-mapped files
+_token_re_bytes = re.compile(_token_pattern.encode(), re.VERBOSE | re.DOTALL)
+_trailing_re_bytes = re.compile(rb"\s*")
+
+_escape_re = re.compile(r"\\.", re.DOTALL)
+_simple_escapes = {
+    "\\\\": "\\",
+    "\\\"": "\"",
+    "\\'": "'",
+    "\\\n": "",
+    "\\n": "\n",
+    "\\r": "\r",
+    "\\t": "\t",
+    "\\b": "\b",
+    "\\f": "\f",
+    "\\v": "\v",
+    "\\a": "\a"
 }
 
+
+def _decode_str(token):
+    content = token[1:-1]
+    if "\\" not in content:
+        return content
+    try:
+        return _escape_re.sub(lambda m: _simple_escapes[m.group(0)], content)
+    except KeyError:
+        # numeric and named escapes are rare enough to defer to Python
+        return ast.literal_eval(token)
+
+
+# Parser states: what the next token may be.
+_S_VALUE = 1        # a value (after ':', or at the start)
+_S_VALUE_CLOSE = 2  # a value or the closing bracket (after opening or ',')
+_S_SEP = 3          # ',', ':' or the closing bracket (after a value)
+
+# Container kinds
+_K_LIST = 0
+_K_TUPLE = 1
+_K_DICT = 2
+_K_CALL = 3
+
+_closers = {_K_LIST: "]", _K_TUPLE: ")", _K_DICT: "}", _K_CALL: ")"}
+
+
 def decode(s):
     """Parses a string in the Python syntax, reconstructs the corresponding
     object, and returns it.
 
+    Only the subset of the Python syntax produced by ``encode`` (plus single
+    quoted strings and the Python names of the constants) is accepted.
+    ``ValueError`` is raised on malformed input.
+
+    The parser is a single-pass state machine that keeps open containers on
+    an explicit stack, so it neither compiles its input nor recurses.
+
     """
-    return eval(s, _eval_dict, {})
+    return _decode(s, _functions)
+
+
+def _decode(s, functions):
+    # s is either a string or a bytes-like object containing UTF-8 text
+    if isinstance(s, str):
+        is_bytes = False
+        match = _token_re.match
+        trailing_match = _trailing_re.match
+    else:
+        is_bytes = True
+        match = _token_re_bytes.match
+        trailing_match = _trailing_re_bytes.match
+    stack = []
+    kind = None
+    items = None
+    func = None
+    comma = False
+    state = _S_VALUE
+    done = False
+    pos = 0
+
+    while True:
+        m = match(s, pos)
+        if m is None:
+            break
+        if done:
+            raise ValueError("Trailing data at position {}".format(pos))
+        pos = m.end()
+        group = m.lastgroup
+
+        if group == "punct":
+            token = m.group(group)
+            if is_bytes:
+                token = token.decode()
+            if token == ",":
+                if state != _S_SEP or kind is None \
+                        or (kind == _K_DICT and len(items) % 2):
+                    raise ValueError("Unexpected ',' at position {}"
+                                     .format(m.start(group)))
+                comma = True
+                state = _S_VALUE_CLOSE
+                continue
+            if token == ":":
+                if state != _S_SEP or kind != _K_DICT \
+                        or not len(items) % 2:
+                    raise ValueError("Unexpected ':' at position {}"
+                                     .format(m.start(group)))
+                state = _S_VALUE
+                continue
+            if state == _S_SEP and token in "[({":
+                raise ValueError("Unexpected '{}' at position {}"
+                                 .format(token, m.start(group)))
+            if token == "[":
+                stack.append((kind, items, func, comma))
+                kind, items, func, comma = _K_LIST, [], None, False
+                state = _S_VALUE_CLOSE
+                continue
+            if token == "(":
+                stack.append((kind, items, func, comma))
+                kind, items, func, comma = _K_TUPLE, [], None, False
+                state = _S_VALUE_CLOSE
+                continue
+            if token == "{":
+                stack.append((kind, items, func, comma))
+                kind, items, func, comma = _K_DICT, [], None, False
+                state = _S_VALUE_CLOSE
+                continue
+
+            # closing bracket
+            if state == _S_VALUE or token != _closers.get(kind) \
+                    or (kind == _K_DICT and len(items) % 2):
+                raise ValueError("Unexpected '{}' at position {}"
+                                 .format(token, m.start(group)))
+            if kind == _K_LIST:
+                value = items
+            elif kind == _K_DICT:
+                it = iter(items)
+                try:
+                    value = dict(zip(it, it))
+                except TypeError as e:
+                    raise ValueError("Invalid dictionary key before "
+                                     "position {}: {}"
+                                     .format(m.start(group), e)) from e
+            elif kind == _K_TUPLE:
+                if comma or len(items) != 1:
+                    value = tuple(items)
+                else:
+                    value = items[0]
+            else:
+                try:
+                    value = func(*items)
+                except ValueError:
+                    raise
+                except Exception as e:
+                    raise ValueError("Invalid arguments for {}: {}"
+                                     .format(func.__name__, e)) from e
+            kind, items, func, comma = stack.pop()
+        else:
+            if state == _S_SEP:
+                raise ValueError("Unexpected value at position {}"
+                                 .format(m.start(group)))
+            token = m.group(group)
+            if group == "float":
+                value = float(token)
+            elif group == "int":
+                value = int(token)
+            else:
+                if is_bytes:
+                    token = token.decode()
+                if group == "str":
+                    try:
+                        value = _decode_str(token)
+                    except (SyntaxError, ValueError) as e:
+                        raise ValueError("Invalid string at position {}: {}"
+                                         .format(m.start(group), e)) from e
+                elif group == "name":
+                    try:
+                        value = _constants[token]
+                    except KeyError:
+                        raise ValueError(
+                            "Unknown name '{}' at position {}"
+                            .format(token, m.start(group))) from None
+                else:
+                    try:
+                        f = functions[token]
+                    except KeyError:
+                        raise ValueError(
+                            "Unknown function '{}' at position {}"
+                            .format(token, m.start(group))) from None
+                    stack.append((kind, items, func, comma))
+                    kind, items, func, comma = _K_CALL, [], f, False
+                    state = _S_VALUE_CLOSE
+                    continue
+
+        # a complete value was obtained
+        if kind is None:
+            result = value
+            done = True
+        else:
+            items.append(value)
+        state = _S_SEP
+
+    if not done or stack or trailing_match(s, pos).end() != len(s):
+        raise ValueError("Invalid PYON data at position {}".format(pos))
+    return result
+
 
+def _create_tmp_file(filename):
+    # Creates a uniquely named file next to ``filename``, so that concurrent
+    # writers do not clobber each other's output.
+    while True:
+        tmpname = "{}.{}.tmp".format(
+            filename, base64.b32encode(os.urandom(5)).decode().lower())
+        try:
+            fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            continue
+        return tmpname, fd
 
-def store_file(filename, x):
+
+def store_file(filename, x, pack_lists=False):
     """Encodes a Python object and writes it to the specified file.
 
+    The output is written progressively as the object is encoded, into a
+    temporary file that replaces ``filename`` once complete.
+    If ``filename`` is a symbolic link, the file it points to is replaced.
+    The permissions of an existing file are kept, but its owner and group
+    become those of the writing process.
+
+    See ``encode`` for the ``pack_lists`` parameter.
+
     """
-    contents = encode(x, True)
-    with open(filename, "w") as f:
-        f.write(contents)
-        f.write("\n")
+    filename = os.path.realpath(filename)
+    tmpname, fd = _create_tmp_file(filename)
+    done = False
+    try:
+        with open(fd, "w") as f:
+            try:
+                os.chmod(tmpname, stat.S_IMODE(os.stat(filename).st_mode))
+            except FileNotFoundError:
+                pass
+            encoder = _PrettyEncoder(pack_lists, f.write)
+            encoder.encode(x)
+            f.write(encoder.get_output())
+            f.write("\n")
+        os.replace(tmpname, filename)
+        done = True
+    finally:
+        if not done:
+            try:
+                os.unlink(tmpname)
+            except FileNotFoundError:
+                pass
 
 
 def load_file(filename):
     """Parses the specified file and returns the decoded Python object.
 
+    The file is memory-mapped and parsed in place, without first being read
+    into a string.
+
     """
-    with open(filename, "r") as f:
-        return decode(f.read())
+    with open(filename, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            # empty files cannot be mapped
+            return decode("")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return _decode(m, _functions)
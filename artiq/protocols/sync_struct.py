@@ -9,31 +9,65 @@ describing each modification made to the structure (*mods*).
 Structures must be PYON serializable and contain only lists, dicts, and
 immutable types. Lists and dicts can be nested arbitrarily.
 
+Messages are sent as binary PYON frames (see ``pyon.encode_frame``) when
+both sides support them, and as PYON text lines otherwise.
+
+Subscribers can restrict themselves to the subtree found at a given path in
+the structure. They then receive that subtree upon initialization, and only
+the mods that modify it, with paths relative to it. Mods that replace the
+subtree (for example by setting one of its parents) are sent as a new
+initialization.
+
+The publisher collects the mods made during a short time window and sends
+them together. Subscribers using binary frames receive them as a single
+*batch* mod, which contains a list of mods to apply in order.
+
+With binary frames, the publisher numbers the mods of each notifier and
+keeps the most recent ones. The init and batch messages carry the number of
+the last mod they include (``version``). A subscriber that reconnects
+presents the version it has reached, and receives the mods it missed
+instead of a new init when they are still available.
+
 """
 
 import asyncio
+import os
+from collections import deque
+from copy import deepcopy
+from functools import partial
 from operator import getitem
+from fractions import Fraction
 
+from artiq.language.units import Quantity
 from artiq.protocols import pyon
-from artiq.protocols.asyncio_server import AsyncioServer
+from artiq.protocols.asyncio_server import AsyncioServer, open_connection
 
 
 _init_string = b"ARTIQ sync_struct\n"
+_init_string_binary = b"ARTIQ sync_struct binary\n"
 
 
 def process_mod(target, mod):
     """Apply a *mod* to the target, mutating it.
 
     """
+    action = mod["action"]
+    if action == "batch":
+        for batched_mod in mod["mods"]:
+            process_mod(target, batched_mod)
+        return
     for key in mod["path"]:
         target = getitem(target, key)
-    action = mod["action"]
     if action == "append":
         target.append(mod["x"])
     elif action == "insert":
         target.insert(mod["i"], mod["x"])
     elif action == "pop":
         target.pop(mod["i"])
+    elif action == "extend":
+        target.extend(mod["x"])
+    elif action == "setslice":
+        target.__setitem__(slice(mod["start"], mod["stop"]), mod["x"])
     elif action == "setitem":
         target.__setitem__(mod["key"], mod["value"])
     elif action == "delitem":
@@ -42,6 +76,90 @@ def process_mod(target, mod):
         raise ValueError
 
 
+def _resolve(struct, path):
+    # Returns the subtree at path, or None if there is none.
+    try:
+        for key in path:
+            struct = getitem(struct, key)
+    except (KeyError, IndexError, TypeError):
+        return None
+    return struct
+
+
+def _scope_mod(mod, path, root):
+    # Translates a mod of the structure root (to which the mod has already
+    # been applied) into a mod of the subtree at path. Returns None if the
+    # mod does not affect that subtree.
+    if not path:
+        return mod
+    mod_path = mod["path"]
+    n = len(path)
+    if len(mod_path) >= n:
+        if tuple(mod_path[:n]) != path:
+            return None
+        r = dict(mod)
+        r["path"] = mod_path[n:]
+        return r
+    if tuple(mod_path) != path[:len(mod_path)]:
+        return None
+    # The mod modifies a container above the subtree. Setting or deleting a
+    # sibling of the subtree's ancestor in a dictionary leaves the subtree
+    # unaffected. Other mods may replace it or shift list indices.
+    key = path[len(mod_path)]
+    container = _resolve(root, mod_path)
+    if (mod["action"] == "setitem"
+            or (mod["action"] == "delitem" and isinstance(container, dict))) \
+            and mod["key"] != key:
+        return None
+    return {"action": "init", "struct": _resolve(root, path)}
+
+
+def _superseded(mods):
+    # Returns the indices of the mods that can be removed from the list
+    # without changing its overall effect: a "setitem" mod followed by
+    # another one on the same key, and the mods acting inside the value it
+    # set, are superseded if no mod in between modifies a container on the
+    # path to that key (which could e.g. shift list indices).
+    drop = set()
+    last_set = dict()
+    paths = []
+    for i, mod in enumerate(mods):
+        path = tuple(mod["path"])
+        paths.append(path)
+        if mod["action"] != "setitem":
+            continue
+        key = mod["key"]
+        j = last_set.get((path, key))
+        last_set[(path, key)] = i
+        if j is None:
+            continue
+        location = path + (key, )
+        n = len(location)
+        inside = []
+        for k in range(j + 1, i):
+            if k in drop:
+                continue
+            p = paths[k]
+            if p[:n] == location:
+                inside.append(k)
+            elif p == path[:len(p)] \
+                    and not (p == path and mods[k]["action"] == "setitem"):
+                break
+        else:
+            drop.add(j)
+            drop.update(inside)
+    return drop
+
+
+def coalesce_mods(mods):
+    """Returns a list of mods that has the same effect as the given one,
+    with the mods that are overwritten by a later "setitem" removed.
+
+    """
+    drop = _superseded(mods)
+    return [mod for i, mod in enumerate(mods) if i not in drop]
+
+
 class Subscriber:
     """An asyncio-based client to connect to a ``Publisher``.
 
@@ -50,27 +168,76 @@ class Subscriber:
         the object received from the publisher and returns the corresponding
         local structure to use. Can be identity.
     :param notify_cb: An optional function called every time a mod is received
-        from the publisher. The mod is passed as parameter.
+        from the publisher. The mod is passed as parameter. Batches of mods
+        are applied to the target as a whole before this function is called
+        once with the batch mod. Batches of a single mod are passed as that
+        mod, and empty batches are not passed.
+    :param path: Path (list of keys) of the subtree of the notifier's
+        structure to subscribe to. By default, the whole structure is used.
+        If the subtree does not exist, the target is built from ``None``.
+        Publishers that only support text lines do not support paths, and
+        ``connect`` raises ``ConnectionError`` with them.
+    :param reconnect: If true, the subscriber reconnects automatically when
+        the connection to the publisher is lost, and resumes from the last
+        mod it received if the publisher still has the mods that followed.
+        Otherwise, a new init is received. Failed attempts are retried after
+        a delay that starts at ``min_backoff`` seconds and doubles up to
+        ``max_backoff`` seconds.
 
     """
-    def __init__(self, notifier_name, target_builder, notify_cb=None):
+    def __init__(self, notifier_name, target_builder, notify_cb=None,
+                 path=[], reconnect=False, min_backoff=0.1, max_backoff=10.0):
         self.notifier_name = notifier_name
         self.target_builder = target_builder
         self.notify_cb = notify_cb
+        self.path = path
+        self.reconnect = reconnect
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.epoch = None
+        self.version = None
+        self._writer = None
 
     @asyncio.coroutine
     def connect(self, host, port):
-        self._reader, self._writer = \
-            yield from asyncio.open_connection(host, port)
-        try:
-            self._writer.write(_init_string)
-            self._writer.write((self.notifier_name + "\n").encode())
-            self.receive_task = asyncio.Task(self._receive_cr())
-        except:
-            self._writer.close()
-            del self._reader
-            del self._writer
-            raise
+        self.host = host
+        self.port = port
+        yield from self._connect()
+        self.receive_task = asyncio.Task(self._receive_cr())
+
+    @asyncio.coroutine
+    def _connect(self):
+        host, port = self.host, self.port
+        # Publishers that do not support binary frames close the connection
+        # when receiving the binary init string. Retry in text mode then.
+        for binary in True, False:
+            if not binary and self.path:
+                raise ConnectionError("Publisher does not support "
+                                      "subscriptions to paths")
+            self._binary = binary
+            self._reader, self._writer = \
+                yield from open_connection(host, port)
+            try:
+                if binary:
+                    self._writer.write(_init_string_binary)
+                else:
+                    self._writer.write(_init_string)
+                self._writer.write((self.notifier_name + "\n").encode())
+                if binary:
+                    options = {"path": list(self.path)}
+                    if self.epoch is not None:
+                        options["epoch"] = self.epoch
+                        options["version"] = self.version
+                    self._writer.write((pyon.encode(options) + "\n").encode())
+                mod = yield from self._recv()
+                if mod is not None:
+                    self._process_mod(mod)
+                    return
+            except:
+                self._close_connection()
+                raise
+            self._close_connection()
+        raise ConnectionError("Publisher closed the connection")
 
     @asyncio.coroutine
     def close(self):
@@ -81,27 +248,83 @@ class Subscriber:
             except asyncio.CancelledError:
                 pass
         finally:
+            self._close_connection()
+
+    def _close_connection(self):
+        if self._writer is not None:
             self._writer.close()
-            del self._reader
-            del self._writer
+            self._reader = None
+            self._writer = None
 
     @asyncio.coroutine
-    def _receive_cr(self):
-        target = None
-        while True:
-            line = yield from self._reader.readline()
+    def _recv(self):
+        if self._binary:
+            try:
+                header = yield from self._reader.readexactly(
+                    pyon.frame_header_size)
+                body = yield from self._reader.readexactly(
+                    pyon.frame_body_length(header))
+            except (asyncio.IncompleteReadError, ConnectionResetError):
+                return None
+            return pyon.decode_frame(header, body)
+        else:
+            try:
+                line = yield from self._reader.readline()
+            except ConnectionResetError:
+                return None
             if not line:
-                return
-            mod = pyon.decode(line.decode())
+                return None
+            return pyon.decode(line.decode())
 
-            if mod["action"] == "init":
-                target = self.target_builder(mod["struct"])
+    def _process_mod(self, mod):
+        if mod["action"] == "batch":
+            mods = mod["mods"]
+        else:
+            mods = [mod]
+        for m in mods:
+            if m["action"] == "init":
+                self._target = self.target_builder(m["struct"])
+            else:
+                process_mod(self._target, m)
+        if "epoch" in mod:
+            self.epoch = mod["epoch"]
+        if "version" in mod:
+            self.version = mod["version"]
+
+        if self.notify_cb is not None:
+            # the publisher sends single mods as batches to give
+            # their version
+            if mod["action"] == "batch" and len(mods) <= 1:
+                if mods:
+                    self.notify_cb(mods[0])
             else:
-                process_mod(target, mod)
-
-            if self.notify_cb is not None:
                 self.notify_cb(mod)
 
+    @asyncio.coroutine
+    def _receive_cr(self):
+        while True:
+            mod = yield from self._recv()
+            if mod is None:
+                if not self.reconnect:
+                    return
+                self._close_connection()
+                yield from self._reconnect()
+            else:
+                self._process_mod(mod)
+
+    @asyncio.coroutine
+    def _reconnect(self):
+        delay = self.min_backoff
+        while True:
+            try:
+                yield from self._connect()
+            except OSError:
+                pass
+            else:
+                return
+            yield from asyncio.sleep(delay)
+            delay = min(2*delay, self.max_backoff)
+
 
 class Notifier:
     """Encapsulates a structure whose changes need to be published.
@@ -119,6 +342,10 @@ class Notifier:
     >>> n.read
     [[42]]
 
+    Slices of lists can be assigned and deleted as well (with a step of 1).
+    Like ``extend``, these generate a single mod whatever the number of
+    elements involved, which is preferable when handling blocks of data.
+
     This class does not perform any network I/O and is meant to be used with
     e.g. the ``Publisher`` for this purpose. Only one publisher at most can be
     associated with a ``Notifier``.
@@ -127,7 +354,10 @@ class Notifier:
         also becomes available as the ``read`` property of the ``Notifier``.
 
     """
-    def __init__(self, backing_struct, root=None, path=[]):
+    __slots__ = ("read", "root", "publish",
+                 "_backing_struct", "_parent", "_key", "_children")
+
+    def __init__(self, backing_struct, root=None, parent=None, key=None):
         self.read = backing_struct
         if root is None:
             self.root = self
@@ -135,7 +365,21 @@ class Notifier:
         else:
             self.root = root
         self._backing_struct = backing_struct
-        self._path = path
+        # The path of nested notifiers is only built when publishing mods,
+        # from the chain of parents.
+        self._parent = parent
+        self._key = key
+        # key -> nested notifier, created on first use
+        self._children = None
+
+    def _get_path(self):
+        path = []
+        notifier = self
+        while notifier._parent is not None:
+            path.append(notifier._key)
+            notifier = notifier._parent
+        path.reverse()
+        return path
 
     # Backing struct modification methods.
     # All modifications must go through them!
@@ -147,7 +391,7 @@ class Notifier:
         self._backing_struct.append(x)
         if self.root.publish is not None:
             self.root.publish(self.root, {"action": "append",
-                                          "path": self._path,
+                                          "path": self._get_path(),
                                           "x": x})
 
     def insert(self, i, x):
@@ -157,9 +401,36 @@ class Notifier:
         self._backing_struct.insert(i, x)
         if self.root.publish is not None:
             self.root.publish(self.root, {"action": "insert",
-                                          "path": self._path,
+                                          "path": self._get_path(),
                                           "i": i, "x": x})
 
+    def extend(self, x):
+        """Append the elements of an iterable to a list.
+
+        """
+        x = list(x)
+        self._backing_struct.extend(x)
+        if self.root.publish is not None:
+            self.root.publish(self.root, {"action": "extend",
+                                          "path": self._get_path(),
+                                          "x": x})
+
+    def clear(self):
+        """Remove all elements from a list.
+
+        """
+        del self[:]
+
+    def truncate(self, n):
+        """Remove the elements of a list that follow the first ``n``.
+
+        ``n`` must not be negative. Lists shorter than ``n`` are unchanged.
+
+        """
+        if n < 0:
+            raise ValueError("Cannot truncate to a negative length")
+        del self[n:]
+
     def pop(self, i=-1):
         """Pop an element from a list. The returned element is not
         encapsulated in a ``Notifier`` and its mutations are no longer
@@ -167,30 +438,193 @@ class Notifier:
 
         """
         r = self._backing_struct.pop(i)
+        self._children = None
         if self.root.publish is not None:
             self.root.publish(self.root, {"action": "pop",
-                                          "path": self._path,
+                                          "path": self._get_path(),
                                           "i": i})
         return r
 
+    def _setslice(self, key, x):
+        start, stop, step = key.indices(len(self._backing_struct))
+        if step != 1:
+            raise ValueError("Slices with steps are not supported")
+        stop = max(start, stop)
+        self._backing_struct[start:stop] = x
+        self._children = None
+        if self.root.publish is not None:
+            self.root.publish(self.root, {"action": "setslice",
+                                          "path": self._get_path(),
+                                          "start": start, "stop": stop,
+                                          "x": x})
+
     def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            self._setslice(key, list(value))
+            return
         self._backing_struct.__setitem__(key, value)
+        if self._children is not None:
+            self._children.pop(key, None)
         if self.root.publish is not None:
             self.root.publish(self.root, {"action": "setitem",
-                                "path": self._path,
+                                "path": self._get_path(),
                                 "key": key,
                                 "value": value})
 
     def __delitem__(self, key):
+        if isinstance(key, slice):
+            self._setslice(key, [])
+            return
         self._backing_struct.__delitem__(key)
+        if self._children is not None:
+            self._children.pop(key, None)
         if self.root.publish is not None:
             self.root.publish(self.root, {"action": "delitem",
-                                          "path": self._path,
+                                          "path": self._get_path(),
                                           "key": key})
 
     def __getitem__(self, key):
         item = getitem(self._backing_struct, key)
-        return Notifier(item, self.root, self._path + [key])
+        children = self._children
+        if children is None:
+            children = self._children = dict()
+        else:
+            try:
+                child = children[key]
+            except (KeyError, TypeError):
+                pass
+            else:
+                # the cached notifier is stale if the item was replaced,
+                # e.g. by a list operation that shifted the indices
+                if child._backing_struct is item:
+                    return child
+        child = type(self)(item, self.root, self, key)
+        try:
+            children[key] = child
+        except TypeError:
+            # unhashable key, e.g. a slice
+            pass
+        return child
+
+
+def _encode_batch(version, mods):
+    return _encode_message({"action": "batch", "version": version,
+                            "mods": mods}, True)
+
+
+def _encode_message(obj, binary):
+    if binary:
+        # binary subscribers are recent enough to decode packed lists
+        return pyon.encode_frame(obj, pack_lists=True)
+    else:
+        return [(pyon.encode(obj) + "\n").encode()]
+
+
+_frozen_types = {type(None), bool, int, float, complex, str, bytes,
+                 Fraction, Quantity}
+
+
+def _is_frozen(x):
+    # True if x cannot be modified through a Notifier, i.e. does not
+    # contain lists, dicts or arrays.
+    t = type(x)
+    if t in _frozen_types:
+        return True
+    if t is tuple:
+        return all(_is_frozen(e) for e in x)
+    return False
+
+
+def _is_frozen_mod(mod):
+    action = mod["action"]
+    if action == "setitem":
+        return _is_frozen(mod["value"])
+    elif action == "append" or action == "insert":
+        return _is_frozen(mod["x"])
+    elif action == "extend" or action == "setslice":
+        # the list itself is not part of the structure
+        return all(_is_frozen(e) for e in mod["x"])
+    else:
+        return True
+
+
+class _PendingMod:
+    # A published mod waiting to be sent, with its form for each subscriber
+    # format (see _Recipient), or None for formats it does not concern:
+    # an encoded text line for text subscribers, and for binary subscribers
+    # the mod itself, to be encoded in a batch frame with the payload of
+    # its arrays. These forms, and the PYON text kept for replays, are made
+    # when the mod is flushed if it only contains immutable values;
+    # otherwise they are made at publication time (with a copy of the mod
+    # for binary subscribers), as the values may be mutated afterwards.
+    __slots__ = "mod", "version", "frozen", "encoded", "replay_text"
+
+    def __init__(self, mod, version):
+        self.mod = mod
+        self.version = version
+        self.frozen = _is_frozen_mod(mod)
+        self.encoded = dict()
+        self.replay_text = None
+
+    def encode(self, format, root):
+        try:
+            return self.encoded[format]
+        except KeyError:
+            pass
+        binary, path = format
+        mod = _scope_mod(self.mod, path, root)
+        if mod is None:
+            r = None
+        elif binary:
+            r = mod if self.frozen else deepcopy(mod)
+        else:
+            r = (pyon.encode(mod) + "\n").encode()
+        self.encoded[format] = r
+        return r
+
+    def encode_replay(self):
+        if self.replay_text is None:
+            self.replay_text = pyon.encode(self.mod, pack_lists=True)
+        return self.replay_text
+
+
+class _Recipient:
+    # Queue of messages for one subscriber, bounded to high_water bytes.
+    # When that limit would be exceeded, the queued messages are dropped and
+    # replaced with a request to send a new init (represented by None); no
+    # messages are queued until that init is sent.
+    def __init__(self, binary, path, high_water):
+        self.binary = binary
+        self.path = path
+        # subscribers with the same format receive the same messages
+        self.format = (binary, path)
+        self.high_water = high_water
+        self.queue = asyncio.Queue()
+        self.queue_bytes = 0
+        self.resyncing = False
+        self.resyncs = 0
+
+    def put(self, chunks):
+        if self.resyncing:
+            return
+        size = sum(len(chunk) for chunk in chunks)
+        if (self.high_water is not None
+                and self.queue_bytes + size > self.high_water):
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue_bytes = 0
+            self.resyncing = True
+            self.queue.put_nowait(None)
+        else:
+            self.queue_bytes += size
+            self.queue.put_nowait(chunks)
+
+    @asyncio.coroutine
+    def get(self):
+        chunks = yield from self.queue.get()
+        if chunks is not None:
+            self.queue_bytes -= sum(len(chunk) for chunk in chunks)
+        return chunks
 
 
 class Publisher(AsyncioServer):
@@ -200,22 +634,75 @@ class Publisher(AsyncioServer):
     :param notifiers: A dictionary containing the notifiers to associate with
         the ``Publisher``. The keys of the dictionary are the names of the
         notifiers to be used with ``Subscriber``.
+    :param batch_window: Time in seconds during which mods are collected
+        before being sent together. Redundant mods are removed from the
+        batch (see ``coalesce_mods``). With the default value of 0, mods are
+        sent at the next iteration of the event loop.
+    :param high_water: Maximum number of bytes of messages queued for a
+        subscriber. When a subscriber is too slow to keep up, its queued
+        messages are discarded and a new init is sent to it instead, once it
+        has received the previous messages. ``None`` removes the limit.
+    :param replay_length: Number of recent mods kept for each notifier, to
+        be sent to reconnecting subscribers that missed them. 0 disables
+        resumption.
+
+    Each notifier has a version number, incremented at each mod. The init
+    message sent to new subscribers is encoded once per version and shared
+    between all the subscribers that connect before the next mod.
+
+    Mods are not encoded when they cannot reach any subscriber, i.e. when a
+    notifier has no subscribers and has published more than
+    ``replay_length`` mods since the last one disconnected. Otherwise,
+    mods that only contain immutable values are encoded when they are sent
+    rather than by the mutating code.
 
     """
-    def __init__(self, notifiers):
+    def __init__(self, notifiers, batch_window=0, high_water=16*1024*1024,
+                 replay_length=1024):
         AsyncioServer.__init__(self)
         self.notifiers = notifiers
+        self.batch_window = batch_window
+        self.high_water = high_water
+        self.replay_length = replay_length
+        # distinguishes the versions of this publisher from those of
+        # previous instances, e.g. before a restart of the master
+        self._epoch = os.urandom(8).hex()
+        # (version, PYON text) of the recent mods
+        self._replay = {k: deque(maxlen=replay_length)
+                        for k in notifiers.keys()}
+        # Number of mods published since the last subscriber disconnected.
+        # Beyond replay_length, no subscriber can resume and mods are no
+        # longer recorded.
+        self._unwatched = {k: replay_length + 1 for k in notifiers.keys()}
         self._recipients = {k: set() for k in notifiers.keys()}
+        self._resyncs = {k: 0 for k in notifiers.keys()}
         self._notifier_names = {id(v): k for k, v in notifiers.items()}
+        self._pending = {k: [] for k in notifiers.keys()}
+        self._flush_handle = None
+        self._versions = {k: 0 for k in notifiers.keys()}
+        # notifier name -> (version, {recipient format: encoded init})
+        self._snapshots = dict()
+        self._snapshot_hits = {k: 0 for k in notifiers.keys()}
 
-        for notifier in notifiers.values():
-            notifier.publish = self.publish
+        for notifier_name, notifier in notifiers.items():
+            notifier.publish = partial(self._publish, notifier_name)
+
+    @asyncio.coroutine
+    def stop(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        yield from AsyncioServer.stop(self)
 
     @asyncio.coroutine
     def _handle_connection_cr(self, reader, writer):
         try:
             line = yield from reader.readline()
-            if line != _init_string:
+            if line == _init_string_binary:
+                binary = True
+            elif line == _init_string:
+                binary = False
+            else:
                 return
 
             line = yield from reader.readline()
@@ -228,29 +715,207 @@ class Publisher(AsyncioServer):
             except KeyError:
                 return
 
-            obj = {"action": "init", "struct": notifier.read}
-            line = pyon.encode(obj) + "\n"
-            writer.write(line.encode())
-
-            queue = asyncio.Queue()
-            self._recipients[notifier_name].add(queue)
+            if binary:
+                line = yield from reader.readline()
+                try:
+                    options = pyon.decode(line.decode())
+                    path = tuple(options["path"])
+                except (ValueError, KeyError, TypeError):
+                    return
+            else:
+                options = dict()
+                path = ()
+
+            recipient = _Recipient(binary, path, self.high_water)
+            # The structure already reflects the pending mods, which must
+            # therefore not be sent to this subscriber after the init.
+            self._flush(notifier_name)
+            chunks = None
+            if options.get("epoch") == self._epoch:
+                chunks = self._encode_replay(notifier_name, recipient,
+                                             options.get("version"))
+            if chunks is None:
+                chunks = self._encode_init(notifier_name, recipient)
+            writer.writelines(chunks)
+
+            self._recipients[notifier_name].add(recipient)
+            self._unwatched[notifier_name] = 0
             try:
                 while True:
-                    line = yield from queue.get()
-                    writer.write(line)
+                    chunks = yield from recipient.get()
+                    if chunks is None:
+                        # Resynchronize the subscriber. Mods flushed here
+                        # are not queued for it as it is still resyncing.
+                        self._flush(notifier_name)
+                        chunks = self._encode_init(notifier_name, recipient)
+                        recipient.resyncing = False
+                        recipient.resyncs += 1
+                        self._resyncs[notifier_name] += 1
+                    writer.writelines(chunks)
                     # raise exception on connection error
                     yield from writer.drain()
             finally:
-                self._recipients[notifier_name].remove(queue)
+                self._recipients[notifier_name].remove(recipient)
         except ConnectionResetError:
             # subscribers disconnecting are a normal occurence
             pass
         finally:
             writer.close()
 
+    def _encode_init(self, notifier_name, recipient):
+        version = self._versions[notifier_name]
+        try:
+            snapshot_version, snapshots = self._snapshots[notifier_name]
+        except KeyError:
+            snapshot_version = None
+        if snapshot_version != version:
+            snapshots = dict()
+            self._snapshots[notifier_name] = version, snapshots
+        try:
+            chunks = snapshots[recipient.format]
+        except KeyError:
+            notifier = self.notifiers[notifier_name]
+            obj = {"action": "init",
+                   "struct": _resolve(notifier.read, recipient.path)}
+            if recipient.binary:
+                obj["epoch"] = self._epoch
+                obj["version"] = version
+            chunks = _encode_message(obj, recipient.binary)
+            snapshots[recipient.format] = chunks
+        else:
+            self._snapshot_hits[notifier_name] += 1
+        return chunks
+
+    def _encode_replay(self, notifier_name, recipient, version):
+        # Returns a batch of the mods published after the given version, or
+        # None if some of them are no longer available.
+        current = self._versions[notifier_name]
+        if not isinstance(version, int) or not version <= current:
+            return None
+        texts = [text for v, text in self._replay[notifier_name]
+                 if v > version]
+        if len(texts) != current - version:
+            return None
+        mods = [pyon.decode(text) for text in texts]
+        path = recipient.path
+        if path:
+            scoped = []
+            for mod in mods:
+                mod_path = mod["path"]
+                n = len(mod_path)
+                if n < len(path) and tuple(mod_path) == path[:n]:
+                    # The structure above the subtree may have changed
+                    # since the mod, so only setting other keys is known
+                    # to leave the subtree unaffected.
+                    if (mod["action"] == "setitem"
+                            and mod["key"] != path[n]):
+                        continue
+                    return None
+                mod = _scope_mod(mod, path, None)
+                if mod is not None:
+                    scoped.append(mod)
+            mods = scoped
+        return _encode_batch(current, mods)
+
     def publish(self, notifier, obj):
-        line = pyon.encode(obj) + "\n"
-        line = line.encode()
-        notifier_name = self._notifier_names[id(notifier)]
+        """Publishes a mod of one of the notifiers. This is called by the
+        notifiers themselves, and only needs to be called explicitly when
+        forwarding mods made elsewhere.
+
+        """
+        self._publish(self._notifier_names[id(notifier)], notifier, obj)
+
+    def _publish(self, notifier_name, notifier, obj):
+        version = self._versions[notifier_name] + 1
+        self._versions[notifier_name] = version
+        # invalidate the cached init messages
+        self._snapshots.pop(notifier_name, None)
+        recipients = self._recipients[notifier_name]
+        if not recipients:
+            unwatched = self._unwatched[notifier_name]
+            self._unwatched[notifier_name] = unwatched + 1
+            if unwatched >= self.replay_length:
+                if unwatched == self.replay_length:
+                    self._replay[notifier_name].clear()
+                return
+
+        pending = _PendingMod(obj, version)
+        # Subtrees are resolved in the current structure, and mutable
+        # values may be modified before the flush: encode those now.
+        for recipient in recipients:
+            if recipient.path or not pending.frozen:
+                pending.encode(recipient.format, notifier.read)
+        if self.replay_length and not pending.frozen:
+            pending.encode_replay()
+        self._pending[notifier_name].append(pending)
+
+        if self._flush_handle is None:
+            loop = asyncio.get_event_loop()
+            if self.batch_window:
+                self._flush_handle = loop.call_later(self.batch_window,
+                                                     self._flush_all)
+            else:
+                self._flush_handle = loop.call_soon(self._flush_all)
+
+    def _flush_all(self):
+        self._flush_handle = None
+        for notifier_name in self._pending.keys():
+            self._flush(notifier_name)
+
+    def _flush(self, notifier_name):
+        pending = self._pending[notifier_name]
+        if not pending:
+            return
+        self._pending[notifier_name] = []
+        root = self.notifiers[notifier_name].read
+        if self.replay_length:
+            replay = self._replay[notifier_name]
+            for p in pending:
+                replay.append((p.version, p.encode_replay()))
+        drop = _superseded([p.mod for p in pending])
+        pending = [p for i, p in enumerate(pending) if i not in drop]
+
+        messages = dict()
         for recipient in self._recipients[notifier_name]:
-            recipient.put_nowait(line)
+            try:
+                chunks = messages[recipient.format]
+            except KeyError:
+                encoded = [p.encode(recipient.format, root) for p in pending]
+                encoded = [e for e in encoded if e is not None]
+                if not encoded:
+                    chunks = None
+                elif recipient.binary:
+                    chunks = _encode_batch(self._versions[notifier_name],
+                                           encoded)
+                else:
+                    # subscribers using text lines may not support batches
+                    chunks = [b"".join(encoded)]
+                messages[recipient.format] = chunks
+            if chunks is not None:
+                recipient.put(chunks)
+
+    def get_metrics(self):
+        """Returns a dictionary giving, for each notifier, its current version
+        number (``version``), the number of init messages that were taken
+        from the cache instead of being encoded (``snapshot_hits``), the
+        number of resynchronizations of slow subscribers so far (``resyncs``)
+        and the state of the queue of each connected subscriber
+        (``subscribers``: a list of dictionaries with the number of queued
+        messages and bytes, and the number of resynchronizations of that
+        subscriber).
+
+        """
+        r = dict()
+        for notifier_name, recipients in self._recipients.items():
+            r[notifier_name] = {
+                "version": self._versions[notifier_name],
+                "snapshot_hits": self._snapshot_hits[notifier_name],
+                "resyncs": self._resyncs[notifier_name],
+                "subscribers": [{"binary": recipient.binary,
+                                 "path": list(recipient.path),
+                                 "queue_depth": recipient.queue.qsize(),
+                                 "queue_bytes": recipient.queue_bytes,
+                                 "resyncs": recipient.resyncs}
+                                for recipient in recipients]
+            }
+        return r
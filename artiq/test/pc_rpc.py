@@ -1,12 +1,16 @@
 import unittest
 import sys
+import socket
 import subprocess
 import asyncio
+import os
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
-from artiq.protocols import pc_rpc
+from artiq.protocols import pc_rpc, sync_struct, pyon
 
 
 test_address = "::1"
@@ -45,6 +49,13 @@ class RPCCase(unittest.TestCase):
             self.assertEqual(test_object, test_object_back)
             with self.assertRaises(pc_rpc.RemoteError):
                 remote.non_existing_method()
+            self.assertEqual(
+                remote.call_rpc_batch([("echo", (1, )),
+                                       ("echo", (), {"x": test_object})]),
+                [1, test_object])
+            with self.assertRaises(pc_rpc.RemoteError):
+                remote.call_rpc_batch([("echo", (1, )),
+                                       ("non_existing_method", )])
             remote.quit()
         finally:
             remote.close_rpc()
@@ -52,6 +63,30 @@ class RPCCase(unittest.TestCase):
     def test_blocking_echo(self):
         self._run_server_and_test(self._blocking_echo)
 
+    def _blocking_pool(self):
+        # retries also wait for the server to start
+        pool = pc_rpc.ClientPool(retries=100, min_backoff=.2, max_backoff=.2)
+        try:
+            with pool.client(test_address, test_port, "test") as remote:
+                self.assertEqual(remote.echo(1), 1)
+            with pool.client(test_address, test_port, "test") as remote2:
+                self.assertIs(remote2, remote)
+                target_names, _ = pool.health_check(test_address, test_port,
+                                                    "test")
+                self.assertEqual(target_names, [pc_rpc.stats_target_name,
+                                                "test"])
+                remote2.quit()
+            for attempt in range(100):
+                time.sleep(.02)
+                if not remote.is_rpc_connected():
+                    break
+            self.assertFalse(remote.is_rpc_connected())
+        finally:
+            pool.close()
+
+    def test_blocking_pool(self):
+        self._run_server_and_test(self._blocking_pool)
+
     @asyncio.coroutine
     def _asyncio_echo(self):
         remote = pc_rpc.AsyncioClient()
@@ -68,21 +103,298 @@ class RPCCase(unittest.TestCase):
             self.assertEqual(test_object, test_object_back)
             with self.assertRaises(pc_rpc.RemoteError):
                 yield from remote.non_existing_method()
+            results = yield from remote.call_rpc_batch(
+                [("echo", (1, )), ("delayed_echo", (0.1, 2))])
+            self.assertEqual(results, [1, 2])
+            # replies to pipelined calls come back as they complete
+            order = []
+            @asyncio.coroutine
+            def call(delay, x):
+                order.append((yield from remote.delayed_echo(delay, x)))
+            yield from asyncio.wait([asyncio.Task(call(0.5, "slow")),
+                                     asyncio.Task(call(0, "fast"))])
+            self.assertEqual(order, ["fast", "slow"])
             yield from remote.quit()
         finally:
             remote.close_rpc()
 
     def _loop_asyncio_echo(self):
-        loop = asyncio.get_event_loop()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
         try:
             loop.run_until_complete(self._asyncio_echo())
         finally:
             loop.close()
+            asyncio.set_event_loop(None)
 
     def test_asyncio_echo(self):
         self._run_server_and_test(self._loop_asyncio_echo)
 
 
+class SocketReaderCase(unittest.TestCase):
+    def test_socket_reader(self):
+        a, b = socket.socketpair()
+        try:
+            reader = pc_rpc._SocketReader(b, bufsize=16)
+            long_line = b"x"*100 + b"\n"
+            a.sendall(b"first\nsec")
+            self.assertEqual(reader.readline(), b"first\n")
+            a.sendall(b"ond\n" + long_line + b"12345")
+            self.assertEqual(reader.readline(), b"second\n")
+            self.assertEqual(reader.readline(), long_line)
+            self.assertEqual(reader.readexactly(2), b"12")
+            data = bytes(range(256))*10
+            a.sendall(data)
+            self.assertEqual(reader.readexactly(3 + len(data)),
+                             b"345" + data)
+            a.close()
+            with self.assertRaises(ConnectionError):
+                reader.readline()
+        finally:
+            a.close()
+            b.close()
+
+
+class _Blocking:
+    def sleep(self, t):
+        time.sleep(t)
+
+    def echo(self, x):
+        return x
+
+
+class _Exclusive:
+    # records the number of calls running at the same time
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    def sleep(self, t):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        time.sleep(t)
+        self.running -= 1
+
+
+class ExecutorCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    @asyncio.coroutine
+    def _do_test_executor(self, executor):
+        server = pc_rpc.Server({"a": _Blocking(), "b": _Blocking()},
+                               executor=executor)
+        yield from server.start(test_address, test_port)
+        try:
+            remote_a = pc_rpc.AsyncioClient()
+            yield from remote_a.connect_rpc(test_address, test_port, "a")
+            remote_b = pc_rpc.AsyncioClient()
+            yield from remote_b.connect_rpc(test_address, test_port, "b")
+            try:
+                # a long call does not delay other targets
+                t0 = time.monotonic()
+                task = asyncio.Task(remote_a.sleep(0.5))
+                yield from asyncio.sleep(0.1)
+                self.assertEqual((yield from remote_b.echo(42)), 42)
+                self.assertLess(time.monotonic() - t0, 0.4)
+                yield from task
+
+                # calls to the same target are serialized
+                t0 = time.monotonic()
+                yield from asyncio.wait([asyncio.Task(remote_a.sleep(0.2)),
+                                         asyncio.Task(remote_a.sleep(0.2))])
+                self.assertGreaterEqual(time.monotonic() - t0, 0.4)
+            finally:
+                remote_a.close_rpc()
+                remote_b.close_rpc()
+        finally:
+            yield from server.stop()
+
+    def test_executor(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            self.loop.run_until_complete(self._do_test_executor(executor))
+
+    @asyncio.coroutine
+    def _do_test_executor_disconnect(self, executor):
+        target = _Exclusive()
+        server = pc_rpc.Server({"a": target}, executor=executor)
+        yield from server.start(test_address, test_port)
+        try:
+            remote = pc_rpc.AsyncioClient()
+            yield from remote.connect_rpc(test_address, test_port, "a")
+            task = asyncio.Task(remote.sleep(0.3))
+            yield from asyncio.sleep(0.1)
+            # the call keeps running after the client disconnects
+            task.cancel()
+            remote.close_rpc()
+            yield from asyncio.wait([task])
+            yield from asyncio.sleep(0.05)
+            remote = pc_rpc.AsyncioClient()
+            yield from remote.connect_rpc(test_address, test_port, "a")
+            try:
+                yield from remote.sleep(0.1)
+            finally:
+                remote.close_rpc()
+            self.assertEqual(target.max_running, 1)
+        finally:
+            yield from server.stop()
+
+    def test_executor_disconnect(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            self.loop.run_until_complete(
+                self._do_test_executor_disconnect(executor))
+
+    @asyncio.coroutine
+    def _do_test_pool(self):
+        pool = pc_rpc.AsyncioClientPool()
+        try:
+            for restart in range(2):
+                server = pc_rpc.Server({"a": _Blocking()})
+                yield from server.start(test_address, test_port)
+                try:
+                    remote = yield from pool.get(test_address, test_port, "a")
+                    self.assertIs(
+                        (yield from pool.get(test_address, test_port, "a")),
+                        remote)
+                    self.assertEqual((yield from remote.echo(restart)),
+                                     restart)
+                finally:
+                    yield from server.stop()
+                yield from asyncio.sleep(0.1)
+                self.assertFalse(remote.is_rpc_connected())
+        finally:
+            pool.close()
+
+    def test_pool(self):
+        self.loop.run_until_complete(self._do_test_pool())
+
+    @asyncio.coroutine
+    def _hung_server(self, reader, writer):
+        # identifies itself, then never answers
+        yield from reader.readline()
+        writer.write((pyon.encode({"targets": ["a"], "parameters": None,
+                                   "features": ["batch"]}) + "\n").encode())
+        yield from reader.read()
+        writer.close()
+
+    @asyncio.coroutine
+    def _do_test_pool_hung(self):
+        server = yield from asyncio.start_server(self._hung_server,
+                                                 test_address, test_port)
+        pool = pc_rpc.AsyncioClientPool()
+        try:
+            remote = yield from pool.get(test_address, test_port, "a")
+            with self.assertRaises(asyncio.TimeoutError):
+                yield from pool.health_check(test_address, test_port, "a",
+                                             timeout=0.2)
+            self.assertIsNot((yield from pool.get(test_address, test_port,
+                                                  "a")), remote)
+        finally:
+            pool.close()
+            # let the connection handlers terminate
+            yield from asyncio.sleep(0.1)
+            server.close()
+            yield from server.wait_closed()
+
+    def test_pool_hung(self):
+        self.loop.run_until_complete(self._do_test_pool_hung())
+
+    @asyncio.coroutine
+    def _do_test_stats(self):
+        mods = []
+        stats = sync_struct.Notifier(dict())
+        stats.publish = lambda notifier, mod: mods.append(mod)
+        server = pc_rpc.Server({"a": _Blocking()}, stats=stats)
+        yield from server.start(test_address, test_port)
+        try:
+            remote = pc_rpc.AsyncioClient()
+            yield from remote.connect_rpc(test_address, test_port, "a")
+            introspection = pc_rpc.AsyncioClient()
+            yield from introspection.connect_rpc(
+                test_address, test_port, pc_rpc.stats_target_name)
+            try:
+                yield from remote.echo(1)
+                yield from remote.call_rpc_batch([("echo", (2,)),
+                                                  ("sleep", (0.2,))])
+                with self.assertRaises(pc_rpc.RemoteError):
+                    yield from remote.echo()
+                with self.assertRaises(pc_rpc.RemoteError):
+                    yield from remote.nonexistent()
+
+                target_stats = (yield from introspection.get_stats())["a"]
+                self.assertIs(server.stats, stats)
+                self.assertEqual(target_stats, stats.read["a"])
+                self.assertEqual(target_stats["invalid_calls"], 1)
+                self.assertGreater(target_stats["bytes_in"], 0)
+                self.assertGreater(target_stats["bytes_out"], 0)
+                echo = target_stats["methods"]["echo"]
+                self.assertEqual((echo["calls"], echo["errors"]), (3, 1))
+                self.assertEqual(sum(echo["latency"]), 3)
+                sleep = target_stats["methods"]["sleep"]
+                self.assertGreaterEqual(sleep["time"], 0.2)
+                buckets = yield from introspection.get_latency_buckets()
+                self.assertEqual(sleep["latency"][buckets.index(1.0)], 1)
+                self.assertTrue(mods)
+
+                yield from introspection.reset_stats()
+                self.assertEqual(stats.read["a"]["methods"], dict())
+            finally:
+                remote.close_rpc()
+                introspection.close_rpc()
+        finally:
+            yield from server.stop()
+
+    def test_stats(self):
+        self.loop.run_until_complete(self._do_test_stats())
+
+    @asyncio.coroutine
+    def _do_test_unix(self, path):
+        address = "unix:" + path
+        server = pc_rpc.Server({"a": _Blocking()})
+        yield from server.start(test_address, test_port)
+        yield from server.start(address, None)
+        try:
+            remote = pc_rpc.AsyncioClient()
+            yield from remote.connect_rpc(address, None, "a")
+            try:
+                self.assertEqual((yield from remote.echo(42)), 42)
+            finally:
+                remote.close_rpc()
+
+            # the socket of a running server is not taken over
+            other = pc_rpc.Server({"a": _Blocking()})
+            with self.assertRaises(OSError):
+                yield from other.start(address, None)
+            yield from other.stop()
+
+            def blocking_echo(address, port):
+                remote = pc_rpc.Client(address, port, "a")
+                try:
+                    return remote.echo(43)
+                finally:
+                    remote.close_rpc()
+            for address, port in (test_address, test_port), (address, None):
+                self.assertEqual((yield from self.loop.run_in_executor(
+                    None, blocking_echo, address, port)), 43)
+        finally:
+            yield from server.stop()
+        self.assertFalse(os.path.exists(path))
+
+    def test_unix(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "rpc.sock")
+            # a stale socket file from a previous server is replaced
+            stale = socket.socket(socket.AF_UNIX)
+            stale.bind(path)
+            stale.close()
+            self.loop.run_until_complete(self._do_test_unix(path))
+
+
 class Echo:
     def __init__(self):
         self.terminate_notify = asyncio.Semaphore(0)
@@ -97,6 +409,11 @@ class Echo:
     def echo(self, x):
         return x
 
+    @asyncio.coroutine
+    def delayed_echo(self, delay, x):
+        yield from asyncio.sleep(delay)
+        return x
+
 
 def run_server():
     loop = asyncio.get_event_loop()
@@ -0,0 +1,87 @@
+"""Benchmarks for ``artiq.protocols.pc_rpc``.
+
+Run with ``python -m artiq.test.pc_rpc_benchmark``.
+
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from artiq.protocols import pc_rpc
+
+
+test_address = "::1"
+test_port = 7777
+
+
+class _Echo:
+    def echo(self, x):
+        return x
+
+
+@asyncio.coroutine
+def _caller(remote, ncalls):
+    for i in range(ncalls):
+        yield from remote.echo(i)
+
+
+@asyncio.coroutine
+def bench_calls(ncallers_list=(1, 4, 16, 64), ncalls=5000):
+    print("Concurrent callers on one AsyncioClient connection")
+    server = pc_rpc.Server({"echo": _Echo()})
+    yield from server.start(test_address, test_port)
+    try:
+        remote = pc_rpc.AsyncioClient()
+        yield from remote.connect_rpc(test_address, test_port, "echo")
+        try:
+            for ncallers in ncallers_list:
+                t0 = time.monotonic()
+                yield from asyncio.wait([
+                    asyncio.Task(_caller(remote, ncalls//ncallers))
+                    for i in range(ncallers)])
+                t = time.monotonic() - t0
+                print("  {:3} callers {:10.0f} calls/s".format(
+                    ncallers, ncallers*(ncalls//ncallers)/t))
+        finally:
+            remote.close_rpc()
+    finally:
+        yield from server.stop()
+
+
+@asyncio.coroutine
+def bench_latency(ncalls=5000):
+    print("Sequential call latency per transport")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        unix_address = "unix:" + os.path.join(tmpdir, "rpc.sock")
+        for name, address in (("TCP " + test_address, test_address),
+                              ("Unix domain socket", unix_address)):
+            server = pc_rpc.Server({"echo": _Echo()})
+            yield from server.start(address, test_port)
+            try:
+                remote = pc_rpc.AsyncioClient()
+                yield from remote.connect_rpc(address, test_port, "echo")
+                try:
+                    t0 = time.monotonic()
+                    yield from _caller(remote, ncalls)
+                    t = (time.monotonic() - t0)/ncalls
+                    print("  {:30} {:7.2f}us {:10.0f} calls/s".format(
+                        name, t*1e6, 1/t))
+                finally:
+                    remote.close_rpc()
+            finally:
+                yield from server.stop()
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(bench_calls())
+        loop.run_until_complete(bench_latency())
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import unittest
+import asyncio
+
+from artiq.master.scheduler import Scheduler
+
+
+_ddb = {
+    "core": {"module": "artiq.sim.devices", "class": "Core",
+             "arguments": {}},
+    "ttl0": {"module": "artiq.sim.devices", "class": "WaveOutput",
+             "arguments": {"name": "ttl0"}},
+    "ttl1": {"module": "artiq.sim.devices", "class": "WaveOutput",
+             "arguments": {"name": "ttl1"}},
+    "pmt": "ttl0"
+}
+
+
+class _Worker:
+    # Runs an experiment until the test ends it, once the scheduler has
+    # granted its devices.
+    def __init__(self, pool):
+        self.pool = pool
+
+    @asyncio.coroutine
+    def run(self, run_params, timeout, handlers):
+        name = run_params["file"]
+        yield from handlers["acquire_devices"](run_params["devices"])
+        self.pool.started.append(name)
+        end = self.pool.ends[name] = asyncio.Future()
+        action = self.pool.actions.get(name)
+        if action is not None:
+            try:
+                result = action(handlers)
+                if asyncio.iscoroutine(result):
+                    result = yield from result
+            except Exception as e:
+                result = e
+            self.pool.results[name] = result
+        yield from end
+
+
+class _WorkerPool:
+    def __init__(self):
+        self.started = []
+        self.ends = dict()
+        self.actions = dict()
+        self.results = dict()
+
+    @asyncio.coroutine
+    def start(self):
+        yield from asyncio.sleep(0)
+
+    @asyncio.coroutine
+    def get(self):
+        yield from asyncio.sleep(0)
+        return _Worker(self)
+
+    def put(self, worker, failed=False):
+        pass
+
+    @asyncio.coroutine
+    def stop(self):
+        yield from asyncio.sleep(0)
+
+
+def _req_devices(names):
+    # Action of a run that requests devices, recording None for those that
+    # are refused.
+    def action(handlers):
+        results = []
+        for name in names:
+            try:
+                results.append(handlers["req_device"](name))
+            except KeyError:
+                results.append(None)
+        return results
+    return action
+
+
+class SchedulerCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def _run(self, test, concurrent_runs):
+        scheduler = Scheduler({"req_device": _ddb.__getitem__},
+                              lambda rid, run_params: None, concurrent_runs)
+        pool = scheduler.worker_pool = _WorkerPool()
+
+        @asyncio.coroutine
+        def run():
+            yield from scheduler.start()
+            try:
+                yield from test(scheduler, pool)
+            finally:
+                yield from scheduler.stop()
+        self.loop.run_until_complete(run())
+
+    def _queue(self, scheduler, name, devices=[], **kwargs):
+        run_params = {"file": name, "unit": None, "arguments": {},
+                      "devices": devices}
+        return scheduler.run_queued(run_params, None, **kwargs)
+
+    @asyncio.coroutine
+    def _settle(self):
+        yield from asyncio.sleep(0.05)
+
+    @asyncio.coroutine
+    def _end(self, pool, name):
+        pool.ends[name].set_result(None)
+        yield from self._settle()
+
+    def test_priority(self):
+        @asyncio.coroutine
+        def test(scheduler, pool):
+            rids = [self._queue(scheduler, "a")]
+            yield from self._settle()
+            for name, priority in ("b", 0), ("c", 2), ("d", 1):
+                rids.append(self._queue(scheduler, name, priority=priority))
+            yield from self._settle()
+            self.assertEqual([rid for rid, _, _ in scheduler.queue.read],
+                             [rids[0], rids[2], rids[3], rids[1]])
+            for name in "acd":
+                yield from self._end(pool, name)
+            self.assertEqual(pool.started, ["a", "c", "d", "b"])
+        self._run(test, 1)
+
+    def test_set_priority(self):
+        @asyncio.coroutine
+        def test(scheduler, pool):
+            a = self._queue(scheduler, "a")
+            yield from self._settle()
+            b = self._queue(scheduler, "b")
+            c = self._queue(scheduler, "c")
+            scheduler.set_priority(c, 1)
+            self.assertEqual([rid for rid, _, _ in scheduler.queue.read],
+                             [a, c, b])
+            self.assertEqual(scheduler.queue.read[1][1]["priority"], 1)
+            with self.assertRaises(NotImplementedError):
+                scheduler.set_priority(a, 1)
+            yield from self._end(pool, "a")
+            self.assertEqual(pool.started, ["a", "c"])
+        self._run(test, 1)
+
+    def test_pipeline(self):
+        @asyncio.coroutine
+        def test(scheduler, pool):
+            self._queue(scheduler, "p1", pipeline="x")
+            self._queue(scheduler, "p2", pipeline="x")
+            # experiments without a pipeline are not serialized
+            self._queue(scheduler, "h1")
+            self._queue(scheduler, "h2")
+            yield from self._settle()
+            self.assertEqual(pool.started, ["p1", "h1", "h2"])
+            yield from self._end(pool, "p1")
+            self.assertEqual(pool.started, ["p1", "h1", "h2", "p2"])
+        self._run(test, 3)
+
+    def test_device_order(self):
+        @asyncio.coroutine
+        def test(scheduler, pool):
+            self._queue(scheduler, "k1", ["core"])
+            self._queue(scheduler, "k2", ["core", "ttl0"])
+            # ttl0 is requested by k2, which comes first
+            self._queue(scheduler, "k3", ["ttl0"])
+            # does not wait for the runs that wait for devices
+            self._queue(scheduler, "h1")
+            yield from self._settle()
+            self.assertEqual(pool.started, ["k1", "h1"])
+            yield from self._end(pool, "k1")
+            self.assertEqual(pool.started, ["k1", "h1", "k2"])
+            yield from self._end(pool, "k2")
+            self.assertEqual(pool.started, ["k1", "h1", "k2", "k3"])
+        self._run(test, 3)
+
+    def test_waiting_limit(self):
+        @asyncio.coroutine
+        def test(scheduler, pool):
+            self._queue(scheduler, "k1", ["core"])
+            self._queue(scheduler, "k2", ["core"])
+            self._queue(scheduler, "h1")
+            yield from self._settle()
+            self.assertEqual(pool.started, ["k1", "h1"])
+            yield from self._end(pool, "h1")
+            self._queue(scheduler, "k3", ["core"])
+            self._queue(scheduler, "h2")
+            yield from self._settle()
+            # k2 and k3 wait, and no more runs are started
+            self.assertEqual(pool.started, ["k1", "h1"])
+            self.assertEqual(len(scheduler._running), 3)
+            yield from self._end(pool, "k1")
+            self.assertEqual(pool.started, ["k1", "h1", "k2", "h2"])
+        self._run(test, 2)
+
+    def test_aliases(self):
+        @asyncio.coroutine
+        def test(scheduler, pool):
+            self._queue(scheduler, "a", ["ttl0"])
+            self._queue(scheduler, "b", ["pmt"])
+            self._queue(scheduler, "c", ["ttl1"])
+            yield from self._settle()
+            self.assertEqual(pool.started, ["a", "c"])
+            yield from self._end(pool, "a")
+            self.assertEqual(pool.started, ["a", "c", "b"])
+        self._run(test, 3)
+
+    def test_acquire_twice(self):
+        @asyncio.coroutine
+        def test(scheduler, pool):
+            pool.actions["a"] = lambda handlers: \
+                handlers["acquire_devices"](["ttl1"])
+            self._queue(scheduler, "a", ["ttl0"])
+            yield from self._settle()
+            self.assertIsInstance(pool.results["a"], RuntimeError)
+            # the devices of the run are unchanged
+            self._queue(scheduler, "b", ["ttl1"])
+            yield from self._settle()
+            self.assertEqual(pool.started, ["a", "b"])
+        self._run(test, 3)
+
+    def test_undeclared(self):
+        @asyncio.coroutine
+        def test(scheduler, pool):
+            pool.actions["k1"] = _req_devices(["core", "ttl1"])
+            self._queue(scheduler, "k1", ["core"])
+            yield from self._settle()
+            self.assertEqual(pool.results["k1"],
+                             [_ddb["core"], _ddb["ttl1"]])
+            self._queue(scheduler, "k2", ["core", "ttl0"])
+            # waits for ttl1, held by k1
+            self._queue(scheduler, "r", ["ttl1"])
+            # ttl0 is held by nobody, but k2 waits for it
+            pool.actions["h"] = _req_devices(["ttl0", "ttl1"])
+            self._queue(scheduler, "h")
+            yield from self._settle()
+            self.assertEqual(pool.started, ["k1", "h"])
+            self.assertEqual(pool.results["h"], [None, None])
+            yield from self._end(pool, "k1")
+            self.assertEqual(pool.started, ["k1", "h", "k2", "r"])
+        self._run(test, 3)
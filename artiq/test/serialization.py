@@ -1,5 +1,7 @@
 import unittest
 import json
+import os
+import tempfile
 from fractions import Fraction
 
 import numpy as np
@@ -36,3 +38,97 @@ class JSONPYON(unittest.TestCase):
             for dec in pyon.decode, json.loads:
                 self.assertEqual(dec(enc(_json_test_object)),
                                  _json_test_object)
+
+
+class PYONDecoder(unittest.TestCase):
+    def test_python_literals(self):
+        self.assertEqual(pyon.decode("(1)"), 1)
+        self.assertEqual(pyon.decode("((1, ), ())"), ((1, ), ()))
+        self.assertEqual(pyon.decode("['a\\'b', None, True, -1e-3, ]"),
+                         ["a'b", None, True, -1e-3])
+        self.assertEqual(pyon.decode("{'x': '\\u00e9\\t'}"), {"x": "é\t"})
+        self.assertEqual(pyon.decode(pyon.encode([float("inf")])),
+                         [float("inf")])
+
+    def test_malformed(self):
+        for s in ("", "[1 2]", "[1,,2]", "{1, 2}", "{1: }", "(, )",
+                  "[1]]", "[1", "foo", "eval(1)", "__import__('os')",
+                  "{[1]: 2}", "\"\\N{DASH}\"", "'\\x4'"):
+            with self.assertRaises(ValueError):
+                pyon.decode(s)
+
+
+class PYONFrame(unittest.TestCase):
+    def test_encdec(self):
+        obj = [_pyon_test_object, np.arange(6, dtype=np.int32).reshape(2, 3),
+               np.zeros((0, 3)), _json_test_object]
+        data = b"".join(pyon.encode_frame(obj))
+        self.assertEqual(len(data) % 8, 0)
+        header = data[:pyon.frame_header_size]
+        body = data[pyon.frame_header_size:]
+        self.assertEqual(pyon.frame_body_length(header), len(body))
+        obj_back = pyon.decode_frame(header, body)
+        self.assertEqual(obj_back[0], _pyon_test_object)
+        np.testing.assert_array_equal(obj_back[1], obj[1])
+        self.assertEqual(obj_back[2].shape, (0, 3))
+        self.assertEqual(obj_back[3], _json_test_object)
+
+
+class PYONPackedList(unittest.TestCase):
+    def test_encdec(self):
+        obj = {
+            "floats": [i/3 for i in range(100)],
+            "ints": list(range(-50, 50)),
+            "bigints": [2**70]*20,
+            "mixed": [1, 2.0]*20,
+            "short": [1.5]
+        }
+        s = pyon.encode(obj, pack_lists=True)
+        self.assertEqual(s.count("packedlist("), 2)
+        obj_back = pyon.decode(s)
+        self.assertEqual(obj_back, obj)
+        self.assertIs(type(obj_back["ints"]), list)
+        self.assertIs(type(obj_back["ints"][0]), int)
+        self.assertIs(type(obj_back["floats"][0]), float)
+
+        data = b"".join(pyon.encode_frame(obj, pack_lists=True))
+        obj_back = pyon.decode_frame(data[:pyon.frame_header_size],
+                                     data[pyon.frame_header_size:])
+        self.assertEqual(obj_back, obj)
+
+
+class PYONFile(unittest.TestCase):
+    def test_store_load(self):
+        obj = {"x{}".format(i): [_pyon_test_object, _json_test_object,
+                                 list(range(1000)), {"a": "é"}]
+               for i in range(100)}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test.pyon")
+            pyon.store_file(filename, obj)
+            with open(filename) as f:
+                self.assertEqual(f.read(), pyon.encode(obj, True) + "\n")
+            self.assertEqual(pyon.load_file(filename), obj)
+            self.assertEqual(os.listdir(tmpdir), ["test.pyon"])
+
+    def test_store_existing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test.pyon")
+            link = os.path.join(tmpdir, "link.pyon")
+            pyon.store_file(filename, 1)
+            os.chmod(filename, 0o640)
+            os.symlink(filename, link)
+            pyon.store_file(link, 2)
+            self.assertTrue(os.path.islink(link))
+            self.assertEqual(pyon.load_file(link), 2)
+            self.assertEqual(os.stat(filename).st_mode & 0o777, 0o640)
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ["link.pyon", "test.pyon"])
+
+    def test_store_error(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test.pyon")
+            pyon.store_file(filename, 1)
+            with self.assertRaises(KeyError):
+                pyon.store_file(filename, [1, object()])
+            self.assertEqual(pyon.load_file(filename), 1)
+            self.assertEqual(os.listdir(tmpdir), ["test.pyon"])
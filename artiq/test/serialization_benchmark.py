@@ -0,0 +1,119 @@
+"""Benchmarks for ``artiq.protocols.pyon``.
+
+Run with ``python -m artiq.test.serialization_benchmark``.
+
+"""
+
+import random
+import timeit
+from fractions import Fraction
+
+import numpy as np
+
+from artiq.language.units import *
+from artiq.protocols import pyon
+
+
+def rt_results_payload(npoints=10000):
+    frequency = [1000 + 1000*i/(npoints - 1) for i in range(npoints)]
+    brightness = [40 + 40*random.random() for i in range(npoints)]
+    return {
+        "flopping_f_simulation.py": {
+            "description": {("frequency", "brightness"): "xy"},
+            "data": {"frequency": frequency, "brightness": brightness}
+        }
+    }
+
+
+def rt_results_mod():
+    return {"action": "append",
+            "path": ["flopping_f_simulation.py", "data", "brightness"],
+            "x": 53.06128273749083}
+
+
+def parameters_payload(nparameters=500):
+    r = dict()
+    for i in range(nparameters):
+        kind = i % 5
+        name = "param{}".format(i)
+        if kind == 0:
+            r[name] = random.random()
+        elif kind == 1:
+            r[name] = random.randrange(1000)
+        elif kind == 2:
+            r[name] = Fraction(random.randrange(1, 1000), 7)*MHz
+        elif kind == 3:
+            r[name] = "ttl{}".format(i)
+        else:
+            r[name] = np.linspace(0, 1, 16)
+    return r
+
+
+_eval_dict = {
+    "__builtins__": None,
+
+    "null": None,
+    "false": False,
+    "true": True,
+
+    "Fraction": Fraction,
+    "Quantity": Quantity,
+    "nparray": pyon._nparray
+}
+
+
+def _decode_eval(s):
+    return eval(s, _eval_dict, {})
+
+
+def _time(f, number):
+    return min(timeit.repeat(f, number=number, repeat=3))/number
+
+
+def bench_decode():
+    payloads = [
+        ("rt_results init", rt_results_payload(), 20),
+        ("rt_results mod", rt_results_mod(), 20000),
+        ("parameter DB", parameters_payload(), 100)
+    ]
+    print("PYON decode")
+    for name, obj, number in payloads:
+        s = pyon.encode(obj)
+        t_parser = _time(lambda: pyon.decode(s), number)
+        t_eval = _time(lambda: _decode_eval(s), number)
+        print("  {:20} {:8} bytes  parser {:9.1f}us  eval {:9.1f}us  "
+              "speedup {:.2f}x".format(name, len(s),
+                                       t_parser*1e6, t_eval*1e6,
+                                       t_eval/t_parser))
+
+        s = pyon.encode(obj, pack_lists=True)
+        t_packed = _time(lambda: pyon.decode(s), number)
+        print("  {:20} {:8} bytes  parser {:9.1f}us  (packed lists)"
+              .format(name, len(s), t_packed*1e6))
+
+
+def bench_encode():
+    payloads = [
+        ("result list", [random.random() for i in range(100000)], 10),
+        ("rt_results init", rt_results_payload(), 20),
+        ("rt_results mod", rt_results_mod(), 20000),
+        ("parameter DB", parameters_payload(), 100)
+    ]
+    print("PYON encode")
+    for name, obj, number in payloads:
+        size = len(pyon.encode(obj))
+        for mode, f in (("text", lambda: pyon.encode(obj)),
+                        ("pretty", lambda: pyon.encode(obj, True)),
+                        ("frame", lambda: pyon.encode_frame(obj))):
+            t = _time(f, number)
+            print("  {:20} {:6} {:8} bytes {:9.1f}us {:8.1f}MB/s"
+                  .format(name, mode, size, t*1e6, size/t/1e6))
+
+
+def main():
+    bench_encode()
+    bench_decode()
+
+
+if __name__ == "__main__":
+    main()
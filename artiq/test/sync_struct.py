@@ -0,0 +1,425 @@
+import unittest
+from unittest import mock
+import asyncio
+import os
+import tempfile
+
+import numpy as np
+
+from artiq.protocols import sync_struct, pyon
+
+
+test_address = "::1"
+test_port = 7777
+
+
+@asyncio.coroutine
+def _old_subscriber(notifier_name):
+    # speaks the text-only protocol of publishers without binary support
+    reader, writer = yield from asyncio.open_connection(test_address,
+                                                        test_port)
+    try:
+        writer.write(b"ARTIQ sync_struct\n")
+        writer.write((notifier_name + "\n").encode())
+        return (yield from reader.readline())
+    finally:
+        writer.close()
+
+
+@asyncio.coroutine
+def _read_frame(reader):
+    header = yield from reader.readexactly(pyon.frame_header_size)
+    body = yield from reader.readexactly(pyon.frame_body_length(header))
+    return header, body
+
+
+class SyncStructCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    @asyncio.coroutine
+    def _wait_received(self, get_received, expected):
+        for attempt in range(100):
+            if get_received() == expected:
+                return
+            yield from asyncio.sleep(.01)
+
+    @asyncio.coroutine
+    def _do_test_recv(self):
+        notifier = sync_struct.Notifier({"a": []})
+        publisher = sync_struct.Publisher({"test": notifier})
+        yield from publisher.start(test_address, test_port)
+        try:
+            received = []
+            notified = []
+            subscriber = sync_struct.Subscriber(
+                "test", lambda x: received.append(x) or x, notified.append)
+            yield from subscriber.connect(test_address, test_port)
+            try:
+                notifier["a"].append(np.linspace(0, 1, 3))
+                notifier["a"].insert(0, (1, 2))
+                notifier["b"] = {"c": 3}
+                notifier["b"]["c"] = 4
+                notifier["a"].pop()
+                del notifier["b"]
+                notifier["a"].append("x")
+                yield from self._wait_received(lambda: received[0]["a"],
+                                               notifier.read["a"])
+                self.assertEqual(received[0].keys(), notifier.read.keys())
+                self.assertEqual(received[0]["a"], [(1, 2), "x"])
+                # mods made in the same event loop iteration are batched
+                self.assertEqual([mod["action"] for mod in notified],
+                                 ["init", "batch"])
+            finally:
+                yield from subscriber.close()
+
+            line = yield from _old_subscriber("test")
+            self.assertEqual(line, b"{\"action\": \"init\", "
+                                   b"\"struct\": {\"a\": [(1, 2), \"x\"]}}\n")
+        finally:
+            yield from publisher.stop()
+
+    def test_recv(self):
+        self.loop.run_until_complete(self._do_test_recv())
+
+    @asyncio.coroutine
+    def _do_test_path(self):
+        notifier = sync_struct.Notifier({"g1": {"data": {"x": []}},
+                                         "g2": {"data": {"x": []}}})
+        publisher = sync_struct.Publisher({"test": notifier})
+        yield from publisher.start(test_address, test_port)
+        try:
+            received = []
+            notified = []
+            subscriber = sync_struct.Subscriber(
+                "test", lambda x: received.append(x) or x, notified.append,
+                path=["g1", "data"])
+            yield from subscriber.connect(test_address, test_port)
+            try:
+                self.assertEqual(received, [{"x": []}])
+                notifier["g1"]["data"]["x"].append(1)
+                notifier["g2"]["data"]["x"].append(2)
+                yield from self._wait_received(lambda: received[-1],
+                                               {"x": [1]})
+                notifier["g2"] = {"data": {}}
+                notifier["g1"] = {"data": {"y": [3]}}
+                yield from self._wait_received(lambda: received[-1],
+                                               {"y": [3]})
+                notifier["g1"]["data"]["y"].append(4)
+                del notifier["g1"]
+                yield from self._wait_received(lambda: received[-1], None)
+                self.assertEqual(received, [{"x": [1]}, {"y": [3, 4]}, None])
+                for mod in notified[1:]:
+                    for m in mod.get("mods", [mod]):
+                        self.assertNotIn("g2", m.get("path", []))
+            finally:
+                yield from subscriber.close()
+        finally:
+            yield from publisher.stop()
+
+    def test_path(self):
+        self.loop.run_until_complete(self._do_test_path())
+
+    @asyncio.coroutine
+    def _do_test_unix(self, address):
+        notifier = sync_struct.Notifier([])
+        publisher = sync_struct.Publisher({"test": notifier})
+        yield from publisher.start(address, None)
+        try:
+            received = []
+            subscriber = sync_struct.Subscriber(
+                "test", lambda x: received.append(x) or x)
+            yield from subscriber.connect(address, None)
+            try:
+                notifier.append(1)
+                yield from self._wait_received(lambda: received[0], [1])
+                self.assertEqual(received, [[1]])
+            finally:
+                yield from subscriber.close()
+        finally:
+            yield from publisher.stop()
+
+    def test_unix(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            address = "unix:" + os.path.join(tmpdir, "notify.sock")
+            self.loop.run_until_complete(self._do_test_unix(address))
+
+    @asyncio.coroutine
+    def _do_test_resync(self):
+        notifier = sync_struct.Notifier([])
+        # every batch of mods overflows the queue
+        publisher = sync_struct.Publisher({"test": notifier}, high_water=0)
+        yield from publisher.start(test_address, test_port)
+        try:
+            received = []
+            subscriber = sync_struct.Subscriber(
+                "test", lambda x: received.append(x) or x)
+            yield from subscriber.connect(test_address, test_port)
+            try:
+                for i in range(10):
+                    notifier.append(i)
+                    yield from asyncio.sleep(0)
+                yield from self._wait_received(lambda: received[-1],
+                                               notifier.read)
+                self.assertEqual(received[-1], list(range(10)))
+                metrics = publisher.get_metrics()["test"]
+                self.assertGreater(metrics["resyncs"], 0)
+                self.assertEqual(metrics["subscribers"][0]["queue_bytes"], 0)
+            finally:
+                yield from subscriber.close()
+        finally:
+            yield from publisher.stop()
+
+    def test_resync(self):
+        self.loop.run_until_complete(self._do_test_resync())
+
+    @asyncio.coroutine
+    def _do_test_snapshot(self):
+        notifier = sync_struct.Notifier({"a": [1, 2]})
+        publisher = sync_struct.Publisher({"test": notifier})
+        yield from publisher.start(test_address, test_port)
+        try:
+            init1 = yield from _old_subscriber("test")
+            init2 = yield from _old_subscriber("test")
+            self.assertEqual(init1, init2)
+            metrics = publisher.get_metrics()["test"]
+            self.assertEqual(metrics["snapshot_hits"], 1)
+            notifier["a"].append(3)
+            self.assertEqual(publisher.get_metrics()["test"]["version"],
+                             metrics["version"] + 1)
+            init3 = yield from _old_subscriber("test")
+            self.assertEqual(pyon.decode(init3.decode()),
+                             {"action": "init", "struct": {"a": [1, 2, 3]}})
+            self.assertEqual(publisher.get_metrics()["test"]["snapshot_hits"],
+                             1)
+        finally:
+            yield from publisher.stop()
+
+    def test_snapshot(self):
+        self.loop.run_until_complete(self._do_test_snapshot())
+
+    @asyncio.coroutine
+    def _do_test_resume(self):
+        notifier = sync_struct.Notifier({"a": []})
+        publisher = sync_struct.Publisher({"test": notifier},
+                                          replay_length=3)
+        yield from publisher.start(test_address, test_port)
+        try:
+            received = []
+            notified = []
+            subscriber = sync_struct.Subscriber(
+                "test", lambda x: received.append(x) or x, notified.append,
+                reconnect=True)
+            yield from subscriber.connect(test_address, test_port)
+            try:
+                for i, count in enumerate([2, 5]):
+                    del notified[:]
+                    subscriber._writer.close()
+                    for j in range(count):
+                        notifier["a"].append((i, j))
+                    yield from self._wait_received(lambda: received[-1],
+                                                   notifier.read)
+                    self.assertEqual(received[-1], notifier.read)
+                    metrics = publisher.get_metrics()["test"]
+                    self.assertEqual(subscriber.version, metrics["version"])
+                    self.assertEqual(notified[0]["action"],
+                                     "batch" if count <= 3 else "init")
+                self.assertEqual(len(received), 2)
+            finally:
+                yield from subscriber.close()
+        finally:
+            yield from publisher.stop()
+
+    def test_resume(self):
+        self.loop.run_until_complete(self._do_test_resume())
+
+    @asyncio.coroutine
+    def _do_test_unwatched_gap(self):
+        notifier = sync_struct.Notifier({"a": []})
+        publisher = sync_struct.Publisher({"test": notifier},
+                                          replay_length=3)
+        yield from publisher.start(test_address, test_port)
+        try:
+            with mock.patch.object(sync_struct, "_PendingMod",
+                                   wraps=sync_struct._PendingMod) as pm:
+                for i in range(5):
+                    notifier["a"].append(i)
+            # mods that no subscriber can resume from are not encoded
+            self.assertEqual(pm.call_count, 0)
+
+            watcher = sync_struct.Subscriber("test", lambda x: x)
+            yield from watcher.connect(test_address, test_port)
+            try:
+                notifier["a"].append(5)
+                yield from self._wait_received(lambda: watcher.version, 6)
+                received = []
+                notified = []
+                subscriber = sync_struct.Subscriber(
+                    "test", lambda x: received.append(x) or x,
+                    notified.append)
+                # resuming from a mod of the gap, which was not recorded
+                subscriber.epoch = watcher.epoch
+                subscriber.version = 2
+                yield from subscriber.connect(test_address, test_port)
+                try:
+                    self.assertEqual(notified[0]["action"], "init")
+                    self.assertEqual(received[-1], notifier.read)
+                finally:
+                    yield from subscriber.close()
+            finally:
+                yield from watcher.close()
+        finally:
+            yield from publisher.stop()
+
+    def test_unwatched_gap(self):
+        self.loop.run_until_complete(self._do_test_unwatched_gap())
+
+    @asyncio.coroutine
+    def _do_test_publish_time_value(self):
+        notifier = sync_struct.Notifier({"a": None})
+        publisher = sync_struct.Publisher({"test": notifier})
+        yield from publisher.start(test_address, test_port)
+        try:
+            received = []
+            subscriber = sync_struct.Subscriber(
+                "test", lambda x: received.append(x) or x)
+            yield from subscriber.connect(test_address, test_port)
+            try:
+                x = [1]
+                notifier["a"] = x
+                # modified after the mod and before it is sent, bypassing
+                # the notifier
+                x.append(2)
+                yield from self._wait_received(lambda: received[0]["a"],
+                                               [1])
+                self.assertEqual(received[0]["a"], [1])
+            finally:
+                yield from subscriber.close()
+        finally:
+            yield from publisher.stop()
+
+    def test_publish_time_value(self):
+        self.loop.run_until_complete(self._do_test_publish_time_value())
+
+    @asyncio.coroutine
+    def _do_test_batch_payload(self):
+        notifier = sync_struct.Notifier({"a": None})
+        publisher = sync_struct.Publisher({"test": notifier})
+        yield from publisher.start(test_address, test_port)
+        try:
+            reader, writer = yield from asyncio.open_connection(test_address,
+                                                                test_port)
+            try:
+                writer.write(b"ARTIQ sync_struct binary\n")
+                writer.write(b"test\n")
+                writer.write(b"{\"path\": []}\n")
+                yield from _read_frame(reader)
+                a = np.arange(1000, dtype=np.float64)
+                notifier["a"] = a
+                header, body = yield from _read_frame(reader)
+                # the array is sent raw in the payload, not in the text
+                text_length, payload_length = \
+                    pyon._frame_header.unpack(header)
+                self.assertEqual(payload_length, a.nbytes)
+                self.assertLess(text_length, 200)
+                batch = pyon.decode_frame(header, body)
+                self.assertEqual(batch["action"], "batch")
+                np.testing.assert_array_equal(batch["mods"][0]["value"], a)
+            finally:
+                writer.close()
+        finally:
+            yield from publisher.stop()
+
+    def test_batch_payload(self):
+        self.loop.run_until_complete(self._do_test_batch_payload())
+
+
+class CoalesceCase(unittest.TestCase):
+    def _check(self, init, mods, expected_count):
+        coalesced = sync_struct.coalesce_mods(mods)
+        self.assertEqual(len(coalesced), expected_count)
+        target1 = pyon.decode(pyon.encode(init))
+        target2 = pyon.decode(pyon.encode(init))
+        for mod in mods:
+            sync_struct.process_mod(target1, mod)
+        sync_struct.process_mod(target2, {"action": "batch",
+                                          "mods": coalesced})
+        self.assertEqual(target1, target2)
+
+    def test_coalesce(self):
+        def setitem(path, key, value):
+            return {"action": "setitem", "path": path,
+                    "key": key, "value": value}
+        def append(path, x):
+            return {"action": "append", "path": path, "x": x}
+
+        self._check({}, [setitem([], "a", 1), setitem([], "b", 2),
+                         setitem([], "a", 3)], 2)
+        self._check({}, [setitem([], "a", []), append(["a"], 1),
+                         setitem([], "a", [2])], 1)
+        self._check({"l": [0, 1]},
+                    [setitem(["l"], 1, 2),
+                     {"action": "insert", "path": ["l"], "i": 0, "x": 5},
+                     setitem(["l"], 1, 3)], 3)
+        self._check({"a": 0},
+                    [setitem([], "a", 1),
+                     {"action": "delitem", "path": [], "key": "a"},
+                     setitem([], "a", 2)], 3)
+        self._check({"a": {"x": 0}, "b": {}},
+                    [setitem(["a"], "x", 1), setitem(["b"], "y", 1),
+                     setitem(["b"], "z", 2),
+                     setitem(["a"], "x", 2)], 3)
+        self._check({"l": [0, 1, 2]},
+                    [setitem(["l"], 2, 5),
+                     {"action": "setslice", "path": ["l"],
+                      "start": 0, "stop": 0, "x": [9]},
+                     setitem(["l"], 2, 6)], 3)
+
+
+class NotifierCase(unittest.TestCase):
+    def test_bulk_mods(self):
+        init = {"a": [0, 1, 2, 3, 4], "b": []}
+        notifier = sync_struct.Notifier(pyon.decode(pyon.encode(init)))
+        mods = []
+        notifier.publish = lambda n, mod: mods.append(pyon.encode(mod))
+
+        notifier["b"].extend(range(100))
+        notifier["b"].extend(x for x in [1.5, 2.5])
+        notifier["a"][1:3] = ["x", "y", "z"]
+        notifier["a"][-2:] = []
+        del notifier["a"][:1]
+        notifier["b"].truncate(10)
+        notifier["b"].truncate(20)
+        with self.assertRaises(ValueError):
+            notifier["b"].truncate(-1)
+        notifier["b"][20:30] = [7]
+        notifier["a"].clear()
+        with self.assertRaises(ValueError):
+            notifier["b"][::2] = []
+        self.assertEqual(len(mods), 9)
+
+        target = pyon.decode(pyon.encode(init))
+        for mod in mods:
+            sync_struct.process_mod(target, pyon.decode(mod))
+        self.assertEqual(target, notifier.read)
+        self.assertEqual(target, {"a": [], "b": list(range(10)) + [7]})
+
+    def test_nested_paths(self):
+        notifier = sync_struct.Notifier({"l": [[], []]})
+        mods = []
+        notifier.publish = lambda n, mod: mods.append(mod)
+
+        first = notifier["l"][0]
+        self.assertIs(notifier["l"][0], first)
+        notifier["l"].insert(0, [])
+        notifier["l"][1].append(1)
+        notifier["l"] = [[2]]
+        notifier["l"][0].append(3)
+        self.assertEqual([mod["path"] for mod in mods],
+                         [["l"], ["l", 1], [], ["l", 0]])
+        self.assertEqual(notifier.read, {"l": [[2, 3]]})
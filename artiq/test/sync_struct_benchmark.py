@@ -0,0 +1,42 @@
+"""Benchmarks for ``artiq.protocols.sync_struct``.
+
+Run with ``python -m artiq.test.sync_struct_benchmark``.
+
+"""
+
+import timeit
+
+from artiq.protocols.sync_struct import Notifier
+
+
+def _time(f, number):
+    return min(timeit.repeat(f, number=number, repeat=3))/number
+
+
+def _discard(notifier, mod):
+    pass
+
+
+def bench_nested_append(number=100000):
+    print("Notifier nested append")
+    struct = {"group": {"data": {"frequency": []}}}
+
+    frequency = struct["group"]["data"]["frequency"]
+    t = _time(lambda: frequency.append(1.0), number)
+    print("  {:30} {:7.2f}us {:10.0f}/s".format("list", t*1e6, 1/t))
+
+    for name, publish in (("notifier, no publisher", None),
+                          ("notifier, publishing", _discard)):
+        notifier = Notifier(struct)
+        notifier.publish = publish
+        t = _time(lambda: notifier["group"]["data"]["frequency"].append(1.0),
+                  number)
+        print("  {:30} {:7.2f}us {:10.0f}/s".format(name, t*1e6, 1/t))
+
+
+def main():
+    bench_nested_append()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import time
+
+from artiq.master.worker import Worker
+
+
+_experiment = """
+import time
+
+from artiq import *
+
+
+class Burst(AutoDB):
+    class DBKeys:
+        implicit_core = False
+        y = Result()
+
+    @staticmethod
+    def realtime_results():
+        return {"y": "raw"}
+
+    def run(self):
+        self.y.append(0)
+        for i in range(1, 101):
+            self.y.append(i)
+        time.sleep(0.5)
+        self.y.append(101)
+"""
+
+
+class WorkerCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    @asyncio.coroutine
+    def _run_experiment(self, filename, handlers):
+        worker = Worker(handlers)
+        yield from worker.create_process()
+        try:
+            yield from worker.run({"file": filename, "unit": None,
+                                   "arguments": {}}, 10.0)
+        finally:
+            yield from worker.end_process()
+
+    def test_rt_results_batching(self):
+        updates = []
+
+        def update_rt_results(mods):
+            updates.append((time.monotonic(),
+                            [mod["x"] for mod in mods]))
+
+        handlers = {
+            "acquire_devices": lambda names: None,
+            "init_rt_results": lambda description: None,
+            "update_rt_results": update_rt_results
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "burst.py")
+            with open(filename, "w") as f:
+                f.write(_experiment)
+            self.loop.run_until_complete(
+                self._run_experiment(filename, handlers))
+
+        # the first point is sent immediately, the burst that follows is
+        # sent in one update once the delay has passed, while the
+        # experiment sleeps, and the last point is sent immediately
+        self.assertEqual([points for _, points in updates],
+                         [[0], list(range(1, 101)), [101]])
+        self.assertLess(updates[1][0] - updates[0][0], 0.4)
+        self.assertGreater(updates[2][0] - updates[1][0], 0.1)
@@ -0,0 +1,174 @@
+"""Benchmarks for ``artiq.master.worker``.
+
+Run with ``python -m artiq.test.worker_benchmark``.
+
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+from functools import partial
+
+from artiq.master.worker import Worker, WorkerPool, default_preload
+from artiq.master.rt_results import RTResults
+
+
+_experiment = """
+from artiq import *
+
+
+class FirstKernel(AutoDB):
+    class DBKeys:
+        started = Parameter()
+
+    @kernel
+    def run(self):
+        self.started = 1
+
+
+class Points(AutoDB):
+    class DBKeys:
+        implicit_core = False
+        npoints = Argument()
+        y = Result()
+
+    @staticmethod
+    def realtime_results():
+        return {"y": "raw"}
+
+    def run(self):
+        for i in range(self.npoints):
+            self.y.append(i)
+"""
+
+
+class _Submission:
+    # Handlers of the worker requests, recording when the experiment
+    # enters its first kernel.
+    def __init__(self):
+        self.started = None
+
+    def req_device(self, name):
+        return {"module": "artiq.sim.devices", "class": "Core",
+                "arguments": {}}
+
+    def req_parameter(self, name):
+        raise KeyError
+
+    def set_parameter(self, name, value):
+        self.started = time.monotonic()
+
+    def handlers(self):
+        return {
+            "acquire_devices": lambda names: None,
+            "req_device": self.req_device,
+            "req_parameter": self.req_parameter,
+            "set_parameter": self.set_parameter,
+            "init_rt_results": lambda description: None,
+            "update_rt_results": lambda mods: None
+        }
+
+
+@asyncio.coroutine
+def _submit_cold(submission, run_params):
+    t0 = time.monotonic()
+    worker = Worker(submission.handlers())
+    yield from worker.create_process()
+    try:
+        yield from worker.run(run_params, 10.0)
+    finally:
+        yield from worker.end_process()
+    return submission.started - t0
+
+
+@asyncio.coroutine
+def _submit_pool(submission, pool, run_params):
+    t0 = time.monotonic()
+    worker = yield from pool.get()
+    try:
+        yield from worker.run(run_params, 10.0)
+    finally:
+        pool.put(worker)
+    return submission.started - t0
+
+
+def _report(name, latencies):
+    latencies = sorted(latencies)
+    print("  {:40} {:8.1f}ms (min {:.1f}ms)".format(
+        name, latencies[len(latencies)//2]*1e3, latencies[0]*1e3))
+
+
+@asyncio.coroutine
+def bench_first_kernel(runs=5):
+    print("Submit to first kernel latency (median)")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file = os.path.join(tmpdir, "first_kernel.py")
+        with open(file, "w") as f:
+            f.write(_experiment)
+        run_params = {"file": file, "unit": "FirstKernel", "arguments": {}}
+
+        submission = _Submission()
+        latencies = []
+        for i in range(runs):
+            latencies.append((yield from _submit_cold(submission,
+                                                      run_params)))
+        _report("new worker process", latencies)
+        # time for replacement workers to get ready
+        ready_wait = 3*max(latencies)
+
+        for name, size, max_runs in (
+                ("pool, worker reused", 1, None),
+                ("pool, fresh worker for each run", 2, 1)):
+            pool = WorkerPool(submission.handlers(), size, max_runs,
+                              preload=default_preload)
+            yield from pool.start()
+            try:
+                latencies = []
+                for i in range(runs):
+                    latencies.append((yield from _submit_pool(
+                        submission, pool, run_params)))
+                    yield from asyncio.sleep(ready_wait)
+                _report(name, latencies)
+            finally:
+                yield from pool.stop()
+
+
+@asyncio.coroutine
+def bench_rt_results(npoints=20000):
+    print("Realtime results appended by an experiment")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file = os.path.join(tmpdir, "points.py")
+        with open(file, "w") as f:
+            f.write(_experiment)
+        run_params = {"file": file, "unit": "Points",
+                      "arguments": {"npoints": npoints}}
+
+        rtr = RTResults()
+        handlers = _Submission().handlers()
+        handlers["init_rt_results"] = partial(rtr.init, "points")
+        handlers["update_rt_results"] = partial(rtr.update, "points")
+        worker = Worker(handlers)
+        yield from worker.create_process()
+        try:
+            t0 = time.monotonic()
+            yield from worker.run(run_params, 10.0)
+            t = time.monotonic() - t0
+        finally:
+            yield from worker.end_process()
+        assert rtr.groups.read["points"]["data"]["y"] == list(range(npoints))
+        print("  {:40} {:8.1f}us {:10.0f} points/s".format(
+            "append", t/npoints*1e6, npoints/t))
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(bench_first_kernel())
+        loop.run_until_complete(bench_rt_results())
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()